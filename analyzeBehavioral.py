@@ -1,34 +1,47 @@
 #!/usr/bin/env python3
 import os
+import sys
 import re
+import io
+import mmap
 from enum import Enum, auto
 from itertools import groupby
-from itertools import zip_longest
+from itertools import zip_longest, chain, repeat
 import math
 from collections import OrderedDict
-from scipy import stats
+from array import array
+from bisect import bisect_left
 import numpy as np
-from openpyxl import Workbook
 import numbers
-
-"""
-Directory wherein all experimental data is stored. Can be recursively organized.
-"""
-LOCALDIR = 'Data/'
+import traceback
+import contextlib
+import hashlib
+import json
+import tempfile
+import zipfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from outputBackends import BACKENDS, openBackends
+from distributions import binEdges, binIndex, binIndices, latencyHistograms
+from resultsFiles import (LOCALDIR, CACHEDIR, HEADER_LINES, Presets, scanResults, getFileNames, readHeader,
+                         directoryMetadata, presetFromLabel)
+from profiling import (PROFILE_ENV, StageProfiler, environmentModes, profileModes, profiled, stage,
+                       writeBatchReport)
 
 """
 Bin size for latency frequency distributions.
 """
 LATENCYSTEP = 0.1
 
+"""
+Version of the parse cache kept in CACHEDIR; bump it whenever parsing changes.
+"""
+CACHE_VERSION = 3
 
-class Presets(Enum):
-    NIGHT_1 = auto()
-    NIGHT_2 = auto()
-    NIGHT_3 = auto()
-    NIGHT_4 = auto()
-    CONTRAST = auto()
-    SPATIAL = auto()
+"""
+Output formats written by analyzeFile, by their names in outputBackends.BACKENDS.
+"""
+FORMATS = ('xlsx',)
 
 
 """Experiment-specific values"""
@@ -53,7 +66,33 @@ class Activity(Enum):
     Running, Poking = auto(), auto()
 
 
+class Devices(Enum):
+    Image, Door, Pump, Wheel = 'Image', 'Door', 'Pump', 'Wheel'
+
+
+"""
+Single-pass tokenizer for the body of a results file. Groups: device, image name, state, time and a marker for
+'revolution' and 'starting' lines. EVENT_PATTERN matches one text line and SCAN_PATTERN is compiled from the same
+source, so the two tokenizers cannot drift apart.
+"""
+_EVENT_SOURCE = (r"(Image|Door|Pump|Wheel)(?: - (?:Name:[ \t]*([^,\n]*?)[ \t]*,[^\n]*?|State: (\w+), )Time: (\S+)"
+                 r"| (revolution|starting))")
+EVENT_PATTERN = re.compile(_EVENT_SOURCE)
+_DEVICES = {d.value: d for d in Devices}
+
+"""
+Bytes form of EVENT_PATTERN for scanning a mapped file with findall. Matches run back to back, each spanning exactly
+one line, with EVENT_PATTERN's groups when the line starts with an event and empty groups otherwise. SCAN_CHUNK bytes
+are scanned per findall call, which bounds how many lines are held at once.
+"""
+SCAN_PATTERN = re.compile(r"(?:{0})?[^\n]*(?:\n|\Z)".format(_EVENT_SOURCE).encode())
+SCAN_CHUNK = 1 << 20
+_DEVICE_BYTES = {d.value.encode(): d for d in Devices}
+REVOLUTION = 'revolution'
+
+
 class Mouse:
+    __slots__ = ('_cageNum', '_rotation_intervals', '_poke_events')
 
     def __init__(self, cageNum, rotation_intervals, poke_events):
         self._cageNum = cageNum
@@ -69,61 +108,263 @@ class Mouse:
         return self._poke_events
 
 
+class EventStore:
+    """
+    Columnar store for the door, pump and wheel events of one session. Times are contiguous float64 arrays and door and
+    pump states are int8 codes (the DoorStates/PumpStates values). Poke event i spans doors [doorOffsets[i],
+    doorOffsets[i + 1]) and pumps [pumpOffsets[i], pumpOffsets[i + 1]); rotation interval j spans the filtered wheel
+    half-times and speeds [wheelOffsets[j], wheelOffsets[j + 1]).
+    Events are appended to compact array buffers while parsing; the NumPy columns are rebuilt on first access after
+    new events arrive.
+    """
+
+    COLUMNS = ('doorTimes', 'doorCodes', 'pumpTimes', 'pumpCodes', 'wheelTimes', 'wheelRPMs',
+               'doorOffsets', 'pumpOffsets', 'wheelOffsets')
+
+    def __init__(self):
+        self._doorTimes, self._doorCodes = array('d'), array('b')
+        self._pumpTimes, self._pumpCodes = array('d'), array('b')
+        self._wheelTimes, self._wheelRPMs = array('d'), array('d')
+        self._doorOffsets, self._pumpOffsets, self._wheelOffsets = array('q', [0]), array('q', [0]), array('q', [0])
+        self._columns = None
+        self._metrics = None
+
+    @classmethod
+    def fromColumns(cls, columns):
+        """
+        Rebuild a store from NumPy COLUMNS, such as those previously read from it.
+        """
+        store = cls()
+        for name, typecode in (('doorTimes', 'd'), ('doorCodes', 'b'), ('pumpTimes', 'd'), ('pumpCodes', 'b'),
+                               ('wheelTimes', 'd'), ('wheelRPMs', 'd'), ('doorOffsets', 'q'), ('pumpOffsets', 'q'),
+                               ('wheelOffsets', 'q')):
+            buffer = array(typecode)
+            buffer.frombytes(np.ascontiguousarray(columns[name], dtype=typecode).tobytes())
+            setattr(store, '_' + name, buffer)
+        store._columns = dict(columns)
+        return store
+
+    def addDoor(self, state, time):
+        self._doorCodes.append(state.value)
+        self._doorTimes.append(time)
+        self._columns, self._metrics = None, None
+
+    def addPump(self, state, time):
+        self._pumpCodes.append(state.value)
+        self._pumpTimes.append(time)
+        self._columns, self._metrics = None, None
+
+    def closePoke(self):
+        """
+        End the current poke event at the latest door and pump events, returning its index.
+        """
+        self._doorOffsets.append(len(self._doorTimes))
+        self._pumpOffsets.append(len(self._pumpTimes))
+        self._columns, self._metrics = None, None
+        return len(self._doorOffsets) - 2
+
+    def addRun(self, halfTimes):
+        """
+        Store a contiguous series of wheel half-rotation times as a rotation interval, returning its index. Speeds
+        above 200 RPM are erratic and dropped along with their half-times, as are the first and last half-times.
+        """
+        halfTimes = np.asarray(halfTimes, dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            # instantaneous speeds btwn beginning and end of rotation event; speeds at the first and last half-times
+            # are never kept so they are not computed
+            rpms = 60 / (halfTimes[2:] - halfTimes[:-2])
+        steady = ~(rpms > 200)  # speeds above 200 RPM are erratic
+        self._wheelRPMs.frombytes(rpms[steady].tobytes())
+        self._wheelTimes.frombytes(halfTimes[1:-1][steady].tobytes())
+        self._wheelOffsets.append(len(self._wheelTimes))
+        self._columns, self._metrics = None, None
+        return len(self._wheelOffsets) - 2
+
+    def doorSpan(self, poke):
+        return self._doorOffsets[poke], self._doorOffsets[poke + 1]
+
+    def pumpSpan(self, poke):
+        return self._pumpOffsets[poke], self._pumpOffsets[poke + 1]
+
+    def wheelSpan(self, run):
+        return self._wheelOffsets[run], self._wheelOffsets[run + 1]
+
+    @property
+    def numPokes(self):
+        return len(self._doorOffsets) - 1
+
+    def pokeMetrics(self, grace=30):
+        """
+        PokeMetrics for every closed poke event, computed once and kept until new events arrive.
+        """
+        if self._metrics is None or self._metrics.grace != grace:
+            self._metrics = PokeMetrics(self, grace)
+        return self._metrics
+
+    @property
+    def numRuns(self):
+        return len(self._wheelOffsets) - 1
+
+    def _column(self, name):
+        if self._columns is None:
+            self._columns = {'doorTimes': np.array(self._doorTimes, dtype=np.float64),
+                             'doorCodes': np.array(self._doorCodes, dtype=np.int8),
+                             'pumpTimes': np.array(self._pumpTimes, dtype=np.float64),
+                             'pumpCodes': np.array(self._pumpCodes, dtype=np.int8),
+                             'wheelTimes': np.array(self._wheelTimes, dtype=np.float64),
+                             'wheelRPMs': np.array(self._wheelRPMs, dtype=np.float64),
+                             'doorOffsets': np.array(self._doorOffsets, dtype=np.int64),
+                             'pumpOffsets': np.array(self._pumpOffsets, dtype=np.int64),
+                             'wheelOffsets': np.array(self._wheelOffsets, dtype=np.int64)}
+        return self._columns[name]
+
+    @property
+    def doorTimes(self):
+        return self._column('doorTimes')
+
+    @property
+    def doorCodes(self):
+        return self._column('doorCodes')
+
+    @property
+    def pumpTimes(self):
+        return self._column('pumpTimes')
+
+    @property
+    def pumpCodes(self):
+        return self._column('pumpCodes')
+
+    @property
+    def wheelTimes(self):
+        return self._column('wheelTimes')
+
+    @property
+    def wheelRPMs(self):
+        return self._column('wheelRPMs')
+
+    @property
+    def doorOffsets(self):
+        return self._column('doorOffsets')
+
+    @property
+    def pumpOffsets(self):
+        return self._column('pumpOffsets')
+
+    @property
+    def wheelOffsets(self):
+        return self._column('wheelOffsets')
+
+
+class PokeMetrics:
+    """
+    Metrics of every poke event of an EventStore at once, computed from the flat door and pump columns and their
+    offsets instead of looping over PokeEvents. Each attribute is an array indexed by poke event and matches the
+    PokeEvent method of the same name: HITS and ALLPOKES count successful pokes and door openings, UNSUCCESSFUL counts
+    distinct door opening times that did not trigger the pump and NOTIMEOUTTOTALS is totalPokesNoTimeout(GRACE).
+    HITTIMES is the time of the last successful poke (NaN without one). The drink durations of poke event i are
+    drinkTimes[drinkOffsets[i]:drinkOffsets[i + 1]].
+    """
+
+    def __init__(self, events, grace=30):
+        self.grace = grace
+        n = events.numPokes
+        doorOffsets, pumpOffsets = events.doorOffsets, events.pumpOffsets
+        # events after the last closed poke event belong to the one still in progress
+        doorTimes, doorCodes = events.doorTimes[:doorOffsets[-1]], events.doorCodes[:doorOffsets[-1]]
+        pumpTimes, pumpCodes = events.pumpTimes[:pumpOffsets[-1]], events.pumpCodes[:pumpOffsets[-1]]
+        doorPoke = np.repeat(np.arange(n), np.diff(doorOffsets))
+        pumpPoke = np.repeat(np.arange(n), np.diff(pumpOffsets))
+        low = doorCodes == DoorStates.Low.value
+        on = pumpCodes == PumpStates.On.value
+
+        self.allPokes = np.bincount(doorPoke[low], minlength=n)
+        self.hits = np.bincount(pumpPoke[on], minlength=n)
+
+        onIndex = np.flatnonzero(on)
+        if len(onIndex):
+            onIndex = onIndex[np.append(pumpPoke[onIndex][1:] != pumpPoke[onIndex][:-1], True)]  # last per poke
+        criticalTimes = np.full(n, np.nan)
+        criticalTimes[pumpPoke[onIndex]] = pumpTimes[onIndex]
+        self.hitTimes = criticalTimes - 0.003  # Pump is activated 3 ms after poke occurs
+
+        # distinct (poke, time) keys of door openings and of pump activations, sorted together so that equal keys
+        # are adjacent; a door opening is unsuccessful if no activation shares its key
+        keyPokes = np.concatenate([doorPoke[low], pumpPoke[on]])
+        keyTimes = np.concatenate([doorTimes[low], pumpTimes[on] - 0.003])
+        fromPump = np.concatenate([np.zeros(low.sum(), dtype=bool), np.ones(on.sum(), dtype=bool)])
+        order = np.lexsort((fromPump, keyTimes, keyPokes))
+        keyPokes, keyTimes, fromPump = keyPokes[order], keyTimes[order], fromPump[order]
+        newKey = np.ones(len(order), dtype=bool)
+        newKey[1:] = (keyPokes[1:] != keyPokes[:-1]) | (keyTimes[1:] != keyTimes[:-1])
+        group = np.cumsum(newKey) - 1
+        hasPump = np.zeros(newKey.sum(), dtype=bool)
+        hasPump[group[fromPump]] = True
+        doorOnly = newKey & ~fromPump & ~hasPump[group]
+        self.unsuccessful = np.bincount(keyPokes[doorOnly], minlength=n)
+
+        keep = (doorTimes <= criticalTimes[doorPoke]) | (doorTimes > criticalTimes[doorPoke] + grace)
+        beforeSuccessful = np.bincount(doorPoke[keep], minlength=n)
+        self.noTimeoutTotals = np.where(self.hits == 1, (beforeSuccessful + 1) // 2, self.allPokes)
+
+        # each pump deactivation ends a drink that began at the latest activation of the same poke event, or at 0
+        latestOn = np.maximum.accumulate(np.where(on, np.arange(len(on)), -1)) if len(on) else onIndex
+        started = latestOn >= pumpOffsets[pumpPoke]
+        drinkStarts = np.where(started, pumpTimes[latestOn], 0.0)
+        self.drinkTimes = (pumpTimes - drinkStarts)[~on]
+        self.drinkOffsets = np.concatenate([[0], np.cumsum(np.bincount(pumpPoke[~on], minlength=n))])
+
+    @property
+    def success(self):
+        return self.hits > 0
+
+
 class RotationInterval:
-    # contiguous series of wheel spins
+    # contiguous series of wheel spins, viewed from the session's EventStore
+    __slots__ = ('_events', '_index', '_image', 'viable')
 
-    def __init__(self, halfTimes, image):
-        self._halfTimes = []
+    def __init__(self, events, index, image):
+        self._events = events
+        self._index = index
         self._image = image
-        self.viable = True
-        self._rpms = []  # instantaneous speeds in rotations per minute
-        raw_rpms = []  # prone to error, will be refined
-
-        for i in range(1, len(halfTimes) - 1):
-            # instantaneous speeds btwn beginning and end of rotation event
-            raw_rpms.append(60 / (halfTimes[i + 1] - halfTimes[i - 1]))
-
-        # instantaneous speeds at beginning and end of rotation event
-        raw_rpms.insert(0, 30 / (halfTimes[1] - halfTimes[0]))
-        raw_rpms.append(30 / (halfTimes[-1] - halfTimes[-2]))
-
-        erratic = []
-        for i in range(1, len(halfTimes) - 1):
-            if raw_rpms[i] > 200:
-                erratic.append(i)
-        for i in range(1, len(halfTimes) - 1):
-            if i not in erratic:
-                self._rpms.append(raw_rpms[i])
-                self._halfTimes.append(halfTimes[i])
-        if len(self._halfTimes) < 2:
-            self.viable = False
+        start, end = events.wheelSpan(index)
+        self.viable = end - start >= 2
 
     def __hash__(self):
         return self.startTime.__hash__()
 
     def numRotations(self):
-        return len(self._halfTimes) // 2
+        start, end = self._events.wheelSpan(self._index)
+        return (end - start) // 2
 
     @property
     def avgSpeed(self):
         # average speed in RPM
-        return self.numRotations() * 60 / (self._halfTimes[-1] - self._halfTimes[0])
+        halfTimes = self.halfTimes
+        return self.numRotations() * 60 / float(halfTimes[-1] - halfTimes[0])
 
     @property
     def speeds(self):
-        return self._rpms
+        # instantaneous speeds in rotations per minute
+        start, end = self._events.wheelSpan(self._index)
+        return self._events.wheelRPMs[start:end]
+
+    @property
+    def index(self):
+        return self._index
 
     @property
     def startTime(self):
-        return self._halfTimes[0]
+        return float(self.halfTimes[0])
 
     @property
     def midTime(self):
-        return (self._halfTimes[-1] + self.halfTimes[0]) / 2
+        halfTimes = self.halfTimes
+        return float(halfTimes[-1] + halfTimes[0]) / 2
 
     @property
     def halfTimes(self):
-        return self._halfTimes
+        start, end = self._events.wheelSpan(self._index)
+        return self._events.wheelTimes[start:end]
 
     @property
     def image(self):
@@ -131,38 +372,46 @@ class RotationInterval:
 
 
 class PokeEvent:
-    # series of repeated pokes
+    # series of repeated pokes, viewed from the session's EventStore
+    __slots__ = ('_events', '_index', '_image', '_imageAppearanceTime', '_imageAppearance', '_pokeTime', '_resolved')
 
-    def __init__(self, doorStates, doorTimes, pumpTimes, pumpStates, image):
-        self._doorStates = doorStates
-        self._doorTimes = doorTimes
-        self._pumpTimes = pumpTimes
-        self._pumpStates = pumpStates
+    def __init__(self, events, index, image, imageAppearanceTime=None):
+        self._events = events
+        self._index = index
         self._image = image
-        self._imageAppearanceTime = image.latestAppearanceTime()
+        # unless given, the poke event belongs to the image's most recent appearance
+        self._imageAppearanceTime = image.latestAppearanceTime() if imageAppearanceTime is None else imageAppearanceTime
         self._imageAppearance = self._image.appearances.get(self._imageAppearanceTime)
         self._imageAppearance.addPokeEvent(self)
         # add this pokeEvent to the image appearance during which it occured
-        s, t = self.successfulPokes()
-        if s == 1:
-            self.latency = t[0] - self._imageAppearanceTime
-            self.pokeTime = t[0]
-        else:
-            self.latency = None
-            self.pokeTime = None
+        self._pokeTime = None
+        self._resolved = False  # latency and poke time are computed on first use
+
+    def _resolve(self):
+        if not self._resolved:
+            metrics = self._events.pokeMetrics()
+            if metrics.hits[self._index] == 1:
+                self._pokeTime = float(metrics.hitTimes[self._index])
+            self._resolved = True
+
+    @property
+    def latency(self):
+        self._resolve()
+        return self._pokeTime - self._imageAppearanceTime if self._pokeTime is not None else None
+
+    @property
+    def pokeTime(self):
+        self._resolve()
+        return self._pokeTime
 
     def isSuccess(self):
-        successful = False
-        for p in self._pumpStates:
-            if p is PumpStates.On:
-                successful = True
-        return successful
+        return bool(self._events.pokeMetrics().hits[self._index])
 
     def successfulPokes(self):
         num = 0
         times = []
-        for p, t in zip(self._pumpStates, self._pumpTimes):
-            if p is PumpStates.On:
+        for p, t in zip(self.pumpCodes.tolist(), self.pumpTimes.tolist()):
+            if p == PumpStates.On.value:
                 num += 1
                 times.append(t - 0.003)  # Pump is activated 3 ms after poke occurs
         return num, times
@@ -170,8 +419,8 @@ class PokeEvent:
     def allPokes(self):
         num = 0
         times = []
-        for p, t in zip(self._doorStates, self._doorTimes):
-            if p is DoorStates.Low:
+        for p, t in zip(self.doorCodes.tolist(), self.doorTimes.tolist()):
+            if p == DoorStates.Low.value:
                 num += 1
                 times.append(t)
         return num, times
@@ -187,14 +436,14 @@ class PokeEvent:
         # returns total number of pokes EXCLUDING those that are failed due to image timeout
         # i.e. after pump success
         critical_time = None
-        for p, t in zip(self._pumpStates, self._pumpTimes):
-            if p is PumpStates.On:
+        for p, t in zip(self.pumpCodes.tolist(), self.pumpTimes.tolist()):
+            if p == PumpStates.On.value:
                 critical_time = t
         if critical_time is None or self.successfulPokes()[0] > 1:
             return self.allPokes()[0]
         else:
             beforeSuccessful = 0
-            for dt in self._doorTimes:
+            for dt in self.doorTimes.tolist():
                 if dt <= critical_time or dt > critical_time + grace:  # 30 seconds grace period
                     beforeSuccessful += 1
             return int(math.ceil(beforeSuccessful / 2))
@@ -204,16 +453,20 @@ class PokeEvent:
     def drinkTimes(self):
         drinkStart = 0
         drinkTimes = []
-        for p, t in zip(self._pumpStates, self._pumpTimes):
-            if p is PumpStates.On:
+        for p, t in zip(self.pumpCodes.tolist(), self.pumpTimes.tolist()):
+            if p == PumpStates.On.value:
                 drinkStart = t
             else:
                 drinkTimes.append(t - drinkStart)
         return drinkTimes
 
+    @property
+    def index(self):
+        return self._index
+
     @property
     def startTime(self):
-        return self._doorTimes[0]
+        return float(self.doorTimes[0])
 
     @property
     def image(self):
@@ -221,19 +474,31 @@ class PokeEvent:
 
     @property
     def doorTimes(self):
-        return self._doorTimes
+        start, end = self._events.doorSpan(self._index)
+        return self._events.doorTimes[start:end]
+
+    @property
+    def doorCodes(self):
+        start, end = self._events.doorSpan(self._index)
+        return self._events.doorCodes[start:end]
 
     @property
     def doorStates(self):
-        return self._doorStates
+        return [DoorStates(c) for c in self.doorCodes.tolist()]
 
     @property
     def pumpTimes(self):
-        return self._pumpTimes
+        start, end = self._events.pumpSpan(self._index)
+        return self._events.pumpTimes[start:end]
+
+    @property
+    def pumpCodes(self):
+        start, end = self._events.pumpSpan(self._index)
+        return self._events.pumpCodes[start:end]
 
     @property
     def pumpStates(self):
-        return self._pumpStates
+        return [PumpStates(c) for c in self.pumpCodes.tolist()]
 
     @property
     def imageAppearanceTime(self):
@@ -245,11 +510,12 @@ class PokeEvent:
 
 
 class Appearance:
+    __slots__ = ('_time', '_image', '_poke_events', '_rewardSeqNum')
 
     def __init__(self, image, time, old_img):
         self._time = time
         self._image = image
-        self._poke_events = []
+        self._poke_events = ()  # most appearances are never poked, so they share the empty tuple until their first
         if old_img.appearances:
             old_app_num = old_img.appearances.get(old_img.latestAppearanceTime()).rewardSeqNum
             self._rewardSeqNum = 0 if image.imageType == ImageTypes.CONTROL else old_app_num + 1
@@ -257,7 +523,10 @@ class Appearance:
             self._rewardSeqNum = 0 if image.imageType == ImageTypes.CONTROL else 1
 
     def addPokeEvent(self, poke_event):
+        if not self._poke_events:
+            self._poke_events = []
         self._poke_events.append(poke_event)
+        self._image.stats.invalidate()
 
     @property
     def poke_events(self):
@@ -277,10 +546,7 @@ class Appearance:
 
 
 class Image:
-    """
-    Log of image appearances by time.
-    """
-    appearanceLog = OrderedDict()
+    __slots__ = ('name', 'imageType', '_appearanceTimes', '_appearances', 'stats')
 
     def __init__(self, name, imageType):
         self.name = name
@@ -288,6 +554,7 @@ class Image:
         self.imageType = imageType
         self._appearanceTimes = []
         self._appearances = {}
+        self.stats = ImageStats(self)
 
     def __eq__(self, other):
         return self.name == other.name and self.imageType == other.imageType
@@ -297,7 +564,9 @@ class Image:
 
     def incrementAppearances(self, time, old_img):
         self._appearanceTimes.append(time)
-        self._appearances[time] = Image.appearanceLog[time] = Appearance(self, time, old_img)
+        self._appearances[time] = Appearance(self, time, old_img)
+        self.stats.invalidate()
+        return self._appearances[time]
 
     @property
     def numAppearances(self):
@@ -314,10 +583,83 @@ class Image:
     def appearances(self):
         return self._appearances
 
-    @staticmethod
-    def imageAtTime(time):
-        appearances = list(Image.appearanceLog.keys())
-        return Image.appearanceLog[max(filter(lambda k: k < time, appearances))].image
+
+def _statistic(family, i):
+    return property(lambda self: self.summary(family)[i])
+
+
+class ImageStats:
+    """
+    Latency statistics of one REWARD image, computed on first use and cached until the image gains an appearance or
+    poke event. True latencies are those of successful pokes; all latencies also count TIMEOUT (the preset's, set by
+    the Session) for every appearance that went without a poke. The _1st families only consider appearances that
+    were first in their reward sequence. The mean, SEM and SD of an empty family are 'N/A'.
+    """
+
+    FAMILIES = ('true', 'all', 'true_1st', 'all_1st')
+    __slots__ = ('_image', '_timeout', '_latencies', '_summaries')
+
+    def __init__(self, image, timeout=None):
+        self._image = image
+        self._timeout = timeout
+        self._latencies = None
+        self._summaries = {}
+
+    def invalidate(self):
+        self._latencies = None
+        self._summaries = {}
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._timeout = timeout
+        self.invalidate()
+
+    def latencies(self, family):
+        if self._latencies is None:
+            latencies = {f: [] for f in self.FAMILIES}
+            for ap in self._image.appearances.values():
+                first = ap.rewardSeqNum == 1
+                if not ap.poke_events:
+                    if self._timeout is None:
+                        continue
+                    latencies['all'].append(self._timeout)
+                    if first:
+                        latencies['all_1st'].append(self._timeout)
+                for pe in ap.poke_events:
+                    if pe.latency is not None:
+                        latencies['true'].append(pe.latency)
+                        latencies['all'].append(pe.latency)
+                        if first:
+                            latencies['true_1st'].append(pe.latency)
+                            latencies['all_1st'].append(pe.latency)
+            self._latencies = latencies
+        return self._latencies[family]
+
+    def summary(self, family):
+        """
+        Mean, SEM and SD of the latencies of FAMILY.
+        """
+        if family not in self._summaries:
+            latencies = self.latencies(family)
+            if latencies:
+                self._summaries[family] = np.mean(latencies), sem(latencies), np.std(latencies)
+            else:
+                self._summaries[family] = 'N/A', 'N/A', 'N/A'
+        return self._summaries[family]
+
+    true_latencies = property(lambda self: self.latencies('true'))
+    all_latencies = property(lambda self: self.latencies('all'))
+    true_latencies_1st = property(lambda self: self.latencies('true_1st'))
+    all_latencies_1st = property(lambda self: self.latencies('all_1st'))
+
+    true_avg_latency, true_SEM_latency, true_SD_latency = (_statistic('true', i) for i in range(3))
+    all_avg_latency, all_SEM_latency, all_SD_latency = (_statistic('all', i) for i in range(3))
+    true_avg_latency_1st, true_SEM_latency_1st, true_SD_latency_1st = (_statistic('true_1st', i) for i in range(3))
+    all_avg_latency_1st, all_SEM_latency_1st, all_SD_latency_1st = (_statistic('all_1st', i) for i in range(3))
 
 
 # def cumulativeSuccess(poke_events):
@@ -338,6 +680,128 @@ class Image:
 #     plt.show()
 
 
+def sem(values):
+    """
+    Standard error of the mean of VALUES with n - 1 degrees of freedom, as from scipy's stats.sem; NaN for fewer than
+    two values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2:
+        return np.float64(np.nan)
+    return np.std(values, ddof=1) / np.sqrt(len(values))
+
+
+class RunningStats:
+    """
+    Streaming mean, SD and SEM of a series of values, updated in O(1) per value with Welford's algorithm. SD is the
+    population SD, as from np.std, and SEM uses n - 1 degrees of freedom, as in sem(). Accumulators built
+    separately, e.g. per session, are combined with merge(). Statistics of fewer values than they need are NaN.
+    """
+
+    def __init__(self, values=()):
+        self.n = 0
+        self.mean = math.nan
+        self._m2 = 0.0  # sum of squared deviations from the mean
+        self.extend(values)
+
+    def add(self, value):
+        self.n += 1
+        if self.n == 1:
+            self.mean = float(value)
+            return
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (value - self.mean)
+
+    def extend(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        # Chan et al. pairwise combination of two partial accumulators
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.mean, self._m2 = other.n, other.mean, other._m2
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self._m2 += other._m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        return self
+
+    @property
+    def variance(self):
+        return self._m2 / self.n if self.n else math.nan
+
+    @property
+    def sd(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def sem(self):
+        return math.sqrt(self._m2 / (self.n - 1) / self.n) if self.n > 1 else math.nan
+
+
+class LatencyHistogram:
+    """
+    Fixed-width histogram of latencies over [0, TIMEOUT] with bins of STEP seconds (LATENCYSTEP by default), binned
+    exactly as by distributions.latencyHistograms: bin i counts latencies in [edges[i], edges[i + 1]) and the last
+    edge, the first multiple of STEP at or above TIMEOUT, falls in the last bin. Values outside the edges are tallied
+    in UNDERFLOW and OVERFLOW, and NaN latencies in MISSING. Histograms with the same range and step combine with
+    merge().
+    """
+
+    def __init__(self, timeout, step=LATENCYSTEP):
+        self.timeout = timeout
+        self.step = step
+        self._edges = binEdges(timeout, step).tolist()
+        self.counts = [0] * (len(self._edges) - 1)
+        self.underflow = 0
+        self.overflow = 0
+        self.missing = 0
+
+    def add(self, latency):
+        # O(1) update of a single latency; extend() bins many at once
+        index = binIndex(latency, self._edges)
+        if index >= 0:
+            self.counts[index] += 1
+        elif latency != latency:
+            self.missing += 1
+        elif latency < 0:
+            self.underflow += 1
+        else:
+            self.overflow += 1
+
+    def extend(self, latencies):
+        latencies = np.asarray(latencies, dtype=np.float64)
+        self.missing += int(np.isnan(latencies).sum())
+        self.underflow += int((latencies < 0).sum())
+        edges = binEdges(self.timeout, self.step)
+        self.overflow += int((latencies > edges[-1]).sum())
+        indices = binIndices(latencies, edges)
+        for i, count in enumerate(np.bincount(indices[indices >= 0], minlength=len(self.counts)).tolist()):
+            self.counts[i] += count
+
+    def merge(self, other):
+        if (other.timeout, other.step) != (self.timeout, self.step):
+            raise ValueError('cannot merge histograms with different bins')
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        self.missing += other.missing
+        return self
+
+    @property
+    def edges(self):
+        return list(self._edges)
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+
 def getContrast(image):
     if "negative" in image.name.lower():
         return 0
@@ -350,27 +814,27 @@ def getContrast(image):
     return CONTRAST_LVLS.get(contrastVal, contrastVal)
 
 
-def pokeLatencies(preset, wb=None):
+@profiled('pokeLatencies')
+def pokeLatencies(session, wb=None, tables=None):
     """
-    Find latencies and associated statistics image-wise for all poke-events. True latencies represent latencies for
-    successful pokes following a reward image appearance, whereas All latencies include missed reward images, using
-    the image reset time as a placeholder estimate.
+    Find latencies and associated statistics image-wise for all poke-events of SESSION. True latencies represent
+    latencies for successful pokes following a reward image appearance, whereas All latencies include missed reward
+    images, using the image reset time as a placeholder estimate. Image-wise statistics are kept by each image's
+    ImageStats.
     If WB (workbook) is specified, latencies are written to the worksheet. If left as none, no output is generated.
     This function produces 4 excel workbooks per worksheet.
+    If TABLES is specified, the latency table and per-image statistics are added to it as 'latencies' and 'images'.
     """
 
     allLatencies = []
     trueLatencies = []
     rewardTimes = []
-    imageWiseTrueLatencies = {}
-    imageWiseAllLatencies = {}
-    imageWiseTrueLatencies_1st = {}
-    imageWiseAllLatencies_1st = {}
+    preset = session.preset
     outProxy = [[], ['Time of REWARD', 'Image Contrast Level', 'Latencies (sec)']]
 
     # contrast instead of name
     # add time in hours
-    for ap in Image.appearanceLog.values():
+    for ap in session.appearances.values():
         if ap.image.imageType != ImageTypes.REWARD:
             continue
         # elif ap.rewardSeqNum != 1:  # only first appearances should be considered
@@ -379,96 +843,40 @@ def pokeLatencies(preset, wb=None):
         contrastLevel = getContrast(ap.image)
 
         if not ap.poke_events:
-            if imageWiseAllLatencies.get(ap.image) is None:
-                imageWiseAllLatencies[ap.image] = []
-            if imageWiseAllLatencies_1st.get(ap.image) is None:
-                imageWiseAllLatencies_1st[ap.image] = []
             if TIMEOUTS.get(preset) is None:
                 continue
-            outProxy.append([ap.time, contrastLevel, TIMEOUTS.get(preset)])
-            allLatencies.append(TIMEOUTS.get(preset))
-            imageWiseAllLatencies[ap.image].append(TIMEOUTS.get(preset))
+            outProxy.append([ap.time, contrastLevel, float(TIMEOUTS.get(preset))])
+            allLatencies.append(float(TIMEOUTS.get(preset)))
             rewardTimes.append(ap.time)
-            if ap.rewardSeqNum == 1:
-                imageWiseAllLatencies_1st[ap.image].append(TIMEOUTS.get(preset))
 
         else:
-            if imageWiseTrueLatencies.get(ap.image) is None:
-                imageWiseTrueLatencies[ap.image] = []
-            if imageWiseAllLatencies.get(ap.image) is None:
-                imageWiseAllLatencies[ap.image] = []
-            if imageWiseTrueLatencies_1st.get(ap.image) is None:
-                imageWiseTrueLatencies_1st[ap.image] = []
-            if imageWiseAllLatencies_1st.get(ap.image) is None:
-                imageWiseAllLatencies_1st[ap.image] = []
             for pe in ap.poke_events:
                 if pe.latency is not None:
                     outProxy.append([pe.imageAppearanceTime, contrastLevel, pe.latency])
                     allLatencies.append(pe.latency)
                     trueLatencies.append(pe.latency)
                     rewardTimes.append(pe.imageAppearanceTime)
-                    imageWiseTrueLatencies[ap.image].append(pe.latency)
-                    imageWiseAllLatencies[ap.image].append(pe.latency)
-                    if ap.rewardSeqNum == 1:
-                        imageWiseTrueLatencies_1st[ap.image].append(pe.latency)
-                        imageWiseAllLatencies_1st[ap.image].append(pe.latency)
                 # NOTE that a poke event has a LATENCY of NONE iff the poke was unsuccessful.
                 # Because latencies are considered only for reward images and REWARD images are
                 # reset once the first poke ceases, such a case is not encountered unless
                 # an erroneous wheel rotation causes event switching and falsely creates two events
                 # one successful and the other unsuccessful.
 
-    rewardImgs = set(filter(lambda im: im.imageType is ImageTypes.REWARD,
-                            [ap.image for ap in Image.appearanceLog.values()]))
-    for ri in rewardImgs:
-
-        ri.true_latencies = imageWiseTrueLatencies.get(ri)
-        ri.all_latencies = imageWiseAllLatencies.get(ri)
-
-        # length of all latencies should be equal to numAppearances
-        # but discrepancy may exist owing to unsuccessful pokes
-
-        ri.true_latencies_1st = imageWiseTrueLatencies_1st.get(ri)
-        ri.all_latencies_1st = imageWiseAllLatencies_1st.get(ri)
-
-        if ri.true_latencies:
-            ri.true_avg_latency = np.mean(imageWiseTrueLatencies.get(ri))
-            ri.true_SEM_latency = stats.sem(imageWiseTrueLatencies.get(ri))
-            ri.true_SD_latency = np.std(imageWiseTrueLatencies.get(ri))
-        else:
-            ri.true_avg_latency = 'N/A'
-            ri.true_SEM_latency = 'N/A'
-            ri.true_SD_latency = 'N/A'
-
-        if ri.true_latencies_1st:
-            ri.true_avg_latency_1st = np.mean(imageWiseTrueLatencies_1st.get(ri))
-            ri.true_SEM_latency_1st = stats.sem(imageWiseTrueLatencies_1st.get(ri))
-            ri.true_SD_latency_1st = np.std(imageWiseTrueLatencies_1st.get(ri))
-        else:
-            ri.true_avg_latency_1st = 'N/A'
-            ri.true_SEM_latency_1st = 'N/A'
-            ri.true_SD_latency_1st = 'N/A'
-
-        if ri.all_latencies:
-            ri.all_avg_latency = np.mean(imageWiseAllLatencies.get(ri))
-            ri.all_SEM_latency = stats.sem(imageWiseAllLatencies.get(ri))
-            ri.all_SD_latency = np.std(imageWiseAllLatencies.get(ri))
-        else:
-            ri.all_avg_latency = 'N/A'
-            ri.all_SEM_latency = 'N/A'
-            ri.all_SD_latency = 'N/A'
-
-        if ri.all_latencies_1st:
-            ri.all_avg_latency_1st = np.mean(imageWiseAllLatencies_1st.get(ri))
-            ri.all_SEM_latency_1st = stats.sem(imageWiseAllLatencies_1st.get(ri))
-            ri.all_SD_latency_1st = np.std(imageWiseAllLatencies_1st.get(ri))
-        else:
-            ri.all_avg_latency_1st = 'N/A'
-            ri.all_SEM_latency_1st = 'N/A'
-            ri.all_SD_latency_1st = 'N/A'
+    # length of all latencies should be equal to numAppearances
+    # but discrepancy may exist owing to unsuccessful pokes
+    rewardImages = list(OrderedDict.fromkeys(ap.image for ap in session.appearances.values()
+                                             if ap.image.imageType is ImageTypes.REWARD))  # in order of appearance
+    pokedImages = [ri for ri in rewardImages if any(ap.poke_events for ap in ri.appearances.values())]
+    imageWiseAllLatencies = {ri: ri.stats.all_latencies for ri in rewardImages}
+    imageWiseTrueLatencies = {ri: ri.stats.true_latencies for ri in pokedImages}
+    imageWiseAllLatencies_1st = {ri: ri.stats.all_latencies_1st for ri in rewardImages}
+    imageWiseTrueLatencies_1st = {ri: ri.stats.true_latencies_1st for ri in pokedImages}
 
     if wb is not None:
-        generateOutput(preset, wb, outProxy, imageWiseTrueLatencies, rewardTimes, allLatencies, trueLatencies)
+        generateOutput(session, wb, outProxy, imageWiseTrueLatencies, rewardTimes, allLatencies, trueLatencies)
+    if tables is not None:
+        tables['latencies'] = (['reward_time', 'contrast', 'latency'], outProxy[2:])
+        tables['images'] = imageStatsTable(rewardImages)
 
     return imageWiseAllLatencies, imageWiseTrueLatencies, imageWiseAllLatencies_1st, imageWiseTrueLatencies_1st
 
@@ -476,13 +884,13 @@ def pokeLatencies(preset, wb=None):
 """
 Helper method to write relevant data to worksheet.
 """
-def generateOutput(preset, wb, outProxy, imageWiseTrueLatencies, rewardTimes, allLatencies, trueLatencies):
+@profiled('generateOutput')
+def generateOutput(session, wb, outProxy, imageWiseTrueLatencies, rewardTimes, allLatencies, trueLatencies):
 
+    preset = session.preset
     ws1 = wb.active
     ws1.append([])
-    rewardImgs = set(filter(lambda im: im.imageType is ImageTypes.REWARD,
-                            [ap.image for ap in Image.appearanceLog.values()]))
-    pokeStatistics(rewardImgs, ws1, preset)
+    pokeStatistics(session.rewardImages(), ws1, preset)
 
     for line in outProxy:
         ws1.append(line)  # send latency documentation to output
@@ -491,14 +899,8 @@ def generateOutput(preset, wb, outProxy, imageWiseTrueLatencies, rewardTimes, al
         return
 
     ws2 = wb.create_sheet(title='All')
-    headings = ["Time", "Latency", ""]
-    sheetData = [[r / (60 ** 2) for r in rewardTimes], allLatencies, []]  # time in hours
-    ws2.append(headings)
-    for row in zip_longest(*sheetData, fillvalue=""):
-        try:
-            ws2.append(row)
-        except ValueError:
-            pass
+    sheetData = [(r / (60 ** 2) for r in rewardTimes), allLatencies, []]  # time in hours
+    writeColumns(ws2, ["Time", "Latency", ""], sheetData)
 
     sheetData = []
     headings = []
@@ -507,53 +909,56 @@ def generateOutput(preset, wb, outProxy, imageWiseTrueLatencies, rewardTimes, al
         headings.extend(["Image Contrast", "Latency"])
         headings.append("")
         latencies = imageWiseTrueLatencies.get(im)
-        sheetData.append([getContrast(im)] * len(latencies) + ["", "MEAN", "SEM", "STD DEV"])
-        sheetData.append(latencies + ["", im.true_avg_latency, im.true_SEM_latency, im.true_SD_latency])
+        sheetData.append(chain(repeat(getContrast(im), len(latencies)), ["", "MEAN", "SEM", "STD DEV"]))
+        sheetData.append(chain(latencies, ["", *im.stats.summary('true')]))
         sheetData.append([])
-    ws3.append(headings)
-    for row in zip_longest(*sheetData, fillvalue=""):
-        try:
-            ws3.append(row)
-        except ValueError:
-            pass
+    writeColumns(ws3, headings, sheetData)
 
     sheetData = []
     headings = []
     ws4 = wb.create_sheet(title='Distributions')
+    hbin, counts = latencyHistograms(imageWiseTrueLatencies, TIMEOUTS.get(preset, 10), [LATENCYSTEP])[LATENCYSTEP]
     for im in sorted(imageWiseTrueLatencies.keys(), key=getContrast):
         headings.extend(["Contrast", "Bin", "Count", "Rel. Frequency", ""])
         latencies = imageWiseTrueLatencies.get(im)
-        count, hbin = np.histogram(latencies, bins=np.arange(0, TIMEOUTS.get(preset, 10) + LATENCYSTEP, LATENCYSTEP))
-        count = list(count)
-        hbin = list(hbin)
-        sheetData.append([getContrast(im)] * len(hbin))
-        sheetData.append(hbin + ["", "Total"])
-        sheetData.append(count + ["", "", sum(count)])
+        count = counts[im]
         percents = [c * 100 / len(latencies) for c in count]
-        sheetData.append(percents + ["", "", sum(percents)])  # relative frequencies as %
+        sheetData.append(repeat(getContrast(im), len(hbin)))
+        sheetData.append(chain(hbin, ["", "Total"]))
+        sheetData.append(chain(count, ["", "", sum(count)]))
+        sheetData.append(chain(percents, ["", "", sum(percents)]))  # relative frequencies as %
         sheetData.append([])
-        # sheetData = list(map(lambda arr: list(map(lambda k: str(k), arr)), sheetData))
-    ws4.append(headings)
-    for row in zip_longest(*sheetData, fillvalue=""):
-        try:
-            ws4.append(row)
-        except ValueError:
-            pass
+    writeColumns(ws4, headings, sheetData)
 
 
+def writeColumns(ws, headings, columns):
+    """
+    Write HEADINGS and then the iterables in COLUMNS side by side beneath them, padding shorter columns with blanks.
+    Rows are assembled one at a time as they are written, so columns may be generators.
+    """
+    ws.append(headings)
+    for row in zip_longest(*columns, fillvalue=""):
+        ws.append(row)
+
 
-def pokesPerHour(poke_events, outputCSV):
+@profiled('pokesPerHour')
+def pokesPerHour(poke_events, outputCSV, tables=None):
     hourlyPokes = {}  # dictionary stores pokes for each hour
     for pe in poke_events:
-        for t, s in zip(pe.pumpTimes, pe.pumpStates):
-            if s is PumpStates.On:
+        for t, s in zip(pe.pumpTimes.tolist(), pe.pumpCodes.tolist()):
+            if s == PumpStates.On.value:
                 hr = int(t / 3600) + 1  # convert t to hours, round up for nth hour
                 # increment pokes for each hour, default value of 0 supplied to initialize
                 hourlyPokes[hr] = hourlyPokes.get(hr, 0) + 1
-    outputCSV.append(['Hour', '# Successful Pokes'])
-    for k in range(1, 13):
-        print("Successful pokes in hour #{0} >> {1}".format(k, hourlyPokes.get(k, 0)))
-        outputCSV.append([k, hourlyPokes.get(k, 0)])
+    rows = [[k, hourlyPokes.get(k, 0)] for k in range(1, 13)]
+    if outputCSV is not None:
+        outputCSV.append(['Hour', '# Successful Pokes'])
+    for k, pokes in rows:
+        print("Successful pokes in hour #{0} >> {1}".format(k, pokes))
+        if outputCSV is not None:
+            outputCSV.append([k, pokes])
+    if tables is not None:
+        tables['hourly_pokes'] = (['hour', 'successful_pokes'], rows)
     return hourlyPokes
 
 
@@ -567,23 +972,16 @@ def pokesPerHour(poke_events, outputCSV):
 #     plt.show()
 
 
-def endRun(wheelHalfTimes, image, rotation_intervals):
+def endRun(events, wheelHalfTimes, image, rotation_intervals):
     if len(wheelHalfTimes) < 3:
         return
-    rotation_intervals.append(RotationInterval(wheelHalfTimes, image))  # add this interval to list
+    ri = RotationInterval(events, events.addRun(wheelHalfTimes), image)
+    if ri.viable:  # erratic intervals are dropped as soon as they close so live sessions never list them
+        rotation_intervals.append(ri)  # add this interval to list
 
 
-def endPoke(doorStates, doorTimes, pumpTimes, pumpStates, image, poke_events):
-    poke_events.append(PokeEvent(doorStates, doorTimes, pumpTimes, pumpStates, image))
-
-
-def pruneRotationIntervals(rotation_intervals):
-    erratic = []
-    for ri in rotation_intervals:
-        if not ri.viable:
-            erratic.append(ri)
-    for ri in erratic:
-        rotation_intervals.remove(ri)
+def endPoke(events, image, poke_events):
+    poke_events.append(PokeEvent(events, events.closePoke(), image))
 
 
 def pokeStatistics(images, outputCSV, preset):
@@ -614,8 +1012,9 @@ def imagePerformance(rewardImgs, outputCSV, preset):
                           "All Latency SEM", "All Latency SD"])
     zero_cont_mean = None
     for ri in rewardImgs:
-        hits = len(ri.true_latencies) if ri.true_latencies else 0
-        numAppearances = len(ri.all_latencies)
+        st = ri.stats
+        hits = len(st.true_latencies) if st.true_latencies else 0
+        numAppearances = len(st.all_latencies)
 
         print('REWARD image appearances for {0} >> {1}'.format(ri.name, numAppearances))
         print('Hits/Successful Pokes >> ', hits)
@@ -627,22 +1026,22 @@ def imagePerformance(rewardImgs, outputCSV, preset):
             if zero_cont_mean is None and contrast != 0:
                 raise ValueError('reward images out of order, need 0 contrast')
             elif contrast == 0:
-                zero_cont_mean = ri.true_avg_latency, ri.all_avg_latency
+                zero_cont_mean = st.true_avg_latency, st.all_avg_latency
 
             isNumber = lambda x: isinstance(x, numbers.Number)
 
             outputCSV.append([ri.name, contrast, numAppearances, hits, numAppearances - hits,
-                              success_rate, ri.true_avg_latency, ri.true_SEM_latency, ri.true_SD_latency,
-                              1 - zero_cont_mean[0] / ri.true_avg_latency if isNumber(zero_cont_mean[0]) and
-                              isNumber(ri.true_avg_latency) else "N/A", "", ri.all_avg_latency,
-                              ri.all_SEM_latency, ri.all_SD_latency,
-                              1 - zero_cont_mean[1] / ri.all_avg_latency if isNumber(ri.all_avg_latency) and
+                              success_rate, st.true_avg_latency, st.true_SEM_latency, st.true_SD_latency,
+                              1 - zero_cont_mean[0] / st.true_avg_latency if isNumber(zero_cont_mean[0]) and
+                              isNumber(st.true_avg_latency) else "N/A", "", st.all_avg_latency,
+                              st.all_SEM_latency, st.all_SD_latency,
+                              1 - zero_cont_mean[1] / st.all_avg_latency if isNumber(st.all_avg_latency) and
                                                                             isNumber(zero_cont_mean[1]) else "N/A"])
 
         else:
             outputCSV.append([ri.name, numAppearances, hits, numAppearances - hits,
-                              success_rate, ri.true_avg_latency, ri.true_SEM_latency, ri.true_SD_latency, "",
-                              ri.all_avg_latency, ri.all_SEM_latency, ri.all_SD_latency])
+                              success_rate, st.true_avg_latency, st.true_SEM_latency, st.true_SD_latency, "",
+                              st.all_avg_latency, st.all_SEM_latency, st.all_SD_latency])
 
 
 def imagePerformanceFirst(rewardImgs, outputCSV, preset):
@@ -658,8 +1057,9 @@ def imagePerformanceFirst(rewardImgs, outputCSV, preset):
                           "All Latency SEM", "All Latency SD"])
     zero_cont_mean = None
     for ri in rewardImgs:
-        hits = len(ri.true_latencies_1st) if ri.true_latencies_1st else 0
-        firstAppearances = len(ri.all_latencies_1st)
+        st = ri.stats
+        hits = len(st.true_latencies_1st) if st.true_latencies_1st else 0
+        firstAppearances = len(st.all_latencies_1st)
         print('FIRST ONLY REWARD image appearances for {0} >> {1}'.format(ri.name, firstAppearances))
         print('Hits/Successful Pokes >> ', hits)
         success_rate = hits * 100.0 / firstAppearances if firstAppearances else 'N/A'
@@ -670,24 +1070,55 @@ def imagePerformanceFirst(rewardImgs, outputCSV, preset):
             if zero_cont_mean is None and contrast != 0:
                 raise ValueError('reward images out of order, need 0 contrast')
             elif contrast == 0:
-                zero_cont_mean = ri.true_avg_latency, ri.all_avg_latency
+                zero_cont_mean = st.true_avg_latency, st.all_avg_latency
 
             isNumber = lambda x: isinstance(x, numbers.Number)
 
             outputCSV.append([ri.name, getContrast(ri), firstAppearances, hits, firstAppearances - hits,
-                              success_rate, ri.true_avg_latency_1st, ri.true_SEM_latency_1st, ri.true_SD_latency_1st,
-                              1 - zero_cont_mean[0] / ri.true_avg_latency_1st if isNumber(ri.true_avg_latency_1st) and
+                              success_rate, st.true_avg_latency_1st, st.true_SEM_latency_1st, st.true_SD_latency_1st,
+                              1 - zero_cont_mean[0] / st.true_avg_latency_1st if isNumber(st.true_avg_latency_1st) and
                               isNumber(zero_cont_mean[0]) else "N/A",
-                              "", ri.all_avg_latency_1st, ri.all_SEM_latency_1st, ri.all_SD_latency_1st,
-                              1 - zero_cont_mean[1] / ri.all_avg_latency_1st if isNumber(ri.all_avg_latency_1st) and
+                              "", st.all_avg_latency_1st, st.all_SEM_latency_1st, st.all_SD_latency_1st,
+                              1 - zero_cont_mean[1] / st.all_avg_latency_1st if isNumber(st.all_avg_latency_1st) and
                               isNumber(zero_cont_mean[1]) else "N/A"])
         else:
             outputCSV.append([ri.name, firstAppearances, hits, firstAppearances - hits,
-                              success_rate, ri.true_avg_latency, ri.true_SEM_latency, ri.true_SD_latency, "",
-                              ri.all_avg_latency, ri.all_SEM_latency, ri.all_SD_latency])
+                              success_rate, st.true_avg_latency, st.true_SEM_latency, st.true_SD_latency, "",
+                              st.all_avg_latency, st.all_SEM_latency, st.all_SD_latency])
 
 
-def analyzeRotations(rotation_intervals, wb):
+def imageStatsTable(rewardImgs):
+    """
+    Per-image statistics from each image's ImageStats, one row per REWARD image in contrast order, for the tabular
+    backends.
+    Statistics that could not be computed are left as None rather than 'N/A'.
+    """
+    def number(x):
+        return float(x) if isinstance(x, numbers.Number) else None
+
+    headings = ['image', 'contrast', 'appearances', 'hits', 'hits_latency_mean', 'hits_latency_sem',
+                'hits_latency_sd', 'all_latency_mean', 'all_latency_sem', 'all_latency_sd', 'first_appearances',
+                'first_hits', 'first_hits_latency_mean', 'first_hits_latency_sem', 'first_hits_latency_sd',
+                'first_all_latency_mean', 'first_all_latency_sem', 'first_all_latency_sd']
+    rows = []
+    for ri in sorted(rewardImgs, key=getContrast):
+        st = ri.stats
+        rows.append([ri.name, getContrast(ri), len(st.all_latencies), len(st.true_latencies)] +
+                    [number(x) for x in st.summary('true') + st.summary('all')] +
+                    [len(st.all_latencies_1st), len(st.true_latencies_1st)] +
+                    [number(x) for x in st.summary('true_1st') + st.summary('all_1st')])
+    return headings, rows
+
+
+@profiled('analyzeRotations')
+def analyzeRotations(rotation_intervals, wb, tables=None):
+    if tables is not None:
+        tables['rpms'] = (['image', 'contrast', 'start_time', 'rotations', 'rpm'],
+                          [[ri.image.name, getContrast(ri.image), ri.startTime, ri.numRotations(), ri.avgSpeed]
+                           for ri in rotation_intervals])
+    if wb is None:
+        return
+
     #imageWiseRPMs
     rot_ints_byImage = {}
     for im, g in groupby(rotation_intervals, key=lambda ri: ri.image):
@@ -703,190 +1134,592 @@ def analyzeRotations(rotation_intervals, wb):
         headings.extend(["Image Contrast", "RPM", "Time"])
         headings.append("")
         rpms = rot_ints_byImage.get(im)
-        sheetData.append([getContrast(im)] * len(rpms) + ["", "MEAN", "SEM", "STD DEV"])
-        speedAvgs = [ri.avgSpeed for ri in rot_ints_byImage.get(im)]
-        sheetData.append(speedAvgs + ["", np.mean(speedAvgs), stats.sem(speedAvgs), np.std(speedAvgs)])
-        sheetData.append([ri.startTime for ri in rot_ints_byImage.get(im)])
+        sheetData.append(chain(repeat(getContrast(im), len(rpms)), ["", "MEAN", "SEM", "STD DEV"]))
+        speedAvgs = [ri.avgSpeed for ri in rpms]
+        sheetData.append(chain(speedAvgs, ["", np.mean(speedAvgs), sem(speedAvgs), np.std(speedAvgs)]))
+        sheetData.append(ri.startTime for ri in rpms)
         sheetData.append([])
 
     try:
         sheetData.append(["", "Global Mean RPM", "Global RPM SEM", "Global RPM STD"])
         globalAvgs = [ri.avgSpeed for ri in rotation_intervals]
-        sheetData.append(["", np.mean(globalAvgs), stats.sem(globalAvgs), np.std(globalAvgs)])
+        sheetData.append(["", np.mean(globalAvgs), sem(globalAvgs), np.std(globalAvgs)])
     except ValueError:
         pass  # this error can only be encountered if there are no rotation intervals
 
-    ws.append(headings)
-    for row in zip_longest(*sheetData, fillvalue=""):
-        try:
-            ws.append(row)
-        except ValueError:
-            pass
+    writeColumns(ws, headings, sheetData)
 
 
-def getFileNames(location):
-    fileNames = []
+def tokenize(lines):
+    """
+    Yield a (device, state, time, name) tuple for every line of LINES. Wheel revolution markers are reported with a
+    state of REVOLUTION and no time. Unrecognized lines yield (None, None, None, None) since they still interrupt a
+    pending wheel skip, whereas device 'starting' announcements carry no information and are dropped entirely.
+    """
+    match = EVENT_PATTERN.match
+    devices = _DEVICES
+    other = (None, None, None, None)
+    for line in lines:
+        m = match(line)
+        if m is None:
+            yield other
+            continue
+        device, name, state, time, marker = m.groups()
+        if marker is None:
+            yield devices[device], state, float(time), name
+        elif marker == REVOLUTION:
+            yield devices[device], REVOLUTION, None, None
 
-    def recursiveDirectories(loc):
-        nonlocal fileNames
-        try:
-            for d in next(os.walk(loc))[1]:
-                recursiveDirectories(loc + d + '/')
-            for f in next(os.walk(loc))[2]:
-                if 'Results' in f and '.txt' in f:
-                    fileNames.append(loc + f)
-        except StopIteration:
-            pass
 
-    recursiveDirectories(location)
-    fileNames.sort()
-    return fileNames
+def scanEvents(buffer, start=0):
+    """
+    tokenize() over the raw bytes of BUFFER from offset START, e.g. a memory-mapped results file. Each chunk of lines
+    is matched in place by one SCAN_PATTERN.findall, which returns the groups of every line without building a str or
+    match object for it. Times are parsed straight from bytes; only states and image names are decoded, once per
+    distinct value.
+    """
+    devices = _DEVICE_BYTES
+    decoded = {}
+    other = (None, None, None, None)
+    findall = SCAN_PATTERN.findall
+    end = len(buffer)
+    while start < end:
+        stop = buffer.find(b'\n', min(start + SCAN_CHUNK, end) - 1) + 1 or end  # chunks end on a line boundary
+        lines = findall(buffer, start, stop)
+        lines.pop()  # the empty match at STOP is not a line
+        for device, name, state, time, marker in lines:
+            if not device:
+                yield other
+            elif not marker:
+                field = state or name
+                text = decoded.get(field)
+                if text is None:
+                    text = decoded[field] = field.decode()
+                if state:
+                    yield devices[device], text, float(time), None
+                else:
+                    yield devices[device], None, float(time), text
+            elif marker == b'revolution':
+                yield devices[device], REVOLUTION, None, None
+        start = stop
 
 
+@profiled('initialize')
 def initialize(allInput, filename, findFloat):
-    images = []
+    """
+    Parse the header of a results file. Returns a dictionary of images keyed by (interned) name, the mouse identifier,
+    the preset and the cage (USB drive ID), or None if the experiment never started. If a name is listed twice, the
+    first listing wins.
+    Lines are consumed only up to the start of the experiment, so an iterator is left positioned at the body.
+    """
+    images = {}
     preset = ''
     mouseNum = 0
+    cage = None
     for line in allInput:
         if 'USB drive ID: ' in line:
             print("\n***********************************\n")
             print(filename)
             print(line)
             mouseNum = int(findFloat.search(line).group(0))
+            cage = line.split('USB drive ID: ')[1].strip()
         elif 'Control image set:' in line:
             for img in line[line.find('[') + 1:line.rfind(']')].split(','):
-                images.append(Image(img.strip(), ImageTypes.CONTROL))
+                name = sys.intern(img.strip())
+                images.setdefault(name, Image(name, ImageTypes.CONTROL))
         elif 'Reward image set:' in line:
             for img in line[line.find('[') + 1:line.rfind(']')].split(','):
-                images.append(Image(img.strip(), ImageTypes.REWARD))
+                name = sys.intern(img.strip())
+                images.setdefault(name, Image(name, ImageTypes.REWARD))
         elif 'preset: ' in line:
-            preset = line.split('preset: ')[1]
-            if 'contrast' in preset.lower():
-                preset = Presets.CONTRAST
-            elif 'spatial' in preset.lower():
-                preset = Presets.SPATIAL
-            elif '1' in preset:
-                preset = Presets.NIGHT_1
-            elif '2' in preset:
-                preset = Presets.NIGHT_2
-            elif '3' in preset:
-                preset = Presets.NIGHT_3
-            elif '4' in preset:
-                preset = Presets.NIGHT_4
+            preset = presetFromLabel(line.split('preset: ')[1])
 
         elif "Start of experiment" in line:
-            return images, "Mouse_{0}".format(mouseNum), preset
+            return images, "Mouse_{0}".format(mouseNum), preset, cage
 
 
-def analyze(fileList, genOutput=True):
-    for filename in fileList:
-        Image.appearanceLog = OrderedDict()  # reset appearances
-        with open(filename, 'r') as resultFile:
-            allInput = resultFile.readlines()
-        findFloat = re.compile("[+-]?([0-9]*[.])?[0-9]+")  # regex to search for a number (float)
-        wheelHalfTimes, doorStates, doorTimes, pumpStates, pumpTimes, poke_events, rotation_intervals = [], [], [], [], [], [], []
-        skipLine = False
-        curImgName = None
-        pokeInProgress = False
-        try:
-            images, identifier, preset = initialize(allInput, filename, findFloat)
-        except TypeError as e:
-            print(e.__traceback__)
-            continue
-        images = set(images)  # convert to set to avoid accidental duplication
-        Image.images = images
+class Session:
+    """
+    Parsed contents of a single results file, along with the location of any generated output. If the file could
+    not be analyzed, ERROR holds the exception raised and the remaining fields are left empty.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.identifier = None
+        self.preset = None
+        self.cage = None  # USB drive ID of the rig, e.g. 'CAGE 1A'
+        self.images = set()
+        self.appearances = OrderedDict()  # image appearances keyed by time, in order of appearance
+        self._appearanceIndex = None  # sorted appearance times and appearances, rebuilt after new appearances
+        self.events = EventStore()
+        self.poke_events = []
+        self.rotation_intervals = []
+        self.outputPaths = []  # files written by the output backends
+        self.profile = None  # StageProfiler report, when instrumentation is on
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    def setImages(self, images):
+        # set once the preset is known; missed REWARD appearances count as the preset's timeout in each ImageStats
+        self.images = set(images)
+        for im in self.images:
+            im.stats.timeout = TIMEOUTS.get(self.preset)
+
+    def addAppearance(self, image, time, old_img):
+        self.appearances[time] = image.incrementAppearances(time, old_img)
+        self._appearanceIndex = None
+
+    def pokeMetrics(self, grace=30):
+        # vectorized metrics of every poke event, indexed like POKE_EVENTS
+        return self.events.pokeMetrics(grace)
+
+    def rewardImages(self):
+        # REWARD images that appeared at least once during the session
+        return set(ap.image for ap in self.appearances.values() if ap.image.imageType is ImageTypes.REWARD)
+
+    def orderedAppearances(self):
+        """
+        Appearances sorted by time, along with a sorted list and float64 array of their times.
+        """
+        if self._appearanceIndex is None:
+            times = sorted(self.appearances.keys())
+            self._appearanceIndex = [self.appearances[t] for t in times], times, np.array(times, dtype=np.float64)
+        return self._appearanceIndex
+
+    def imageAtTime(self, time):
+        # image most recently shown strictly before TIME
+        appearances, times, _ = self.orderedAppearances()
+        i = bisect_left(times, time) - 1
+        if i < 0:
+            raise ValueError('no image appearance before {0}'.format(time))
+        return appearances[i].image
+
+    def imagesAtTimes(self, times):
+        """
+        Vectorized imageAtTime: for each of TIMES, the index into orderedAppearances() of the appearance shown strictly
+        before it, or -1 if no image had appeared yet.
+        """
+        _, _, appearanceTimes = self.orderedAppearances()
+        return np.searchsorted(appearanceTimes, np.asarray(times, dtype=np.float64), side='left') - 1
+
+
+def parseFile(filename):
+    """
+    Parse a single results file into a Session. Exceptions are propagated to the caller.
+    """
+    with open(filename, 'r') as resultFile:
+        return parseLines(resultFile, filename)
+
+
+def parseMappedFile(filename):
+    """
+    parseFile() by memory-mapping the file and scanning its body in place with parseBuffer. The result is the same;
+    it is not the default because benchmark.py does not show it to be consistently faster than reading text lines.
+    """
+    with open(filename, 'rb') as resultFile:
+        if os.fstat(resultFile.fileno()).st_size == 0:
+            return parseLines([], filename)  # an empty file cannot be mapped, and has no start of experiment anyway
+        with mmap.mmap(resultFile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return parseBuffer(buffer, filename)
+
+
+def parseBuffer(buffer, filename):
+    """
+    Parse the bytes of a whole results file in BUFFER into a Session. The header is decoded as text lines, as
+    parseLines would read it, and the body is tokenized by scanEvents without being decoded.
+    """
+    parser = SessionParser(filename)
+    start = buffer.find(b'Start of experiment')
+    headerEnd = len(buffer) if start < 0 else (buffer.find(b'\n', start) + 1 or len(buffer))
+    if parser.feedHeader(io.StringIO(buffer[:headerEnd].decode(), newline=None)):
+        parser.feedTokens(scanEvents(buffer, headerEnd))
+    return parser.finish()
+
+
+class SessionParser:
+    """
+    Incremental parse state machine for one results file. feed() accepts complete lines as they become available and
+    carries the current activity, the open wheel run and poke event, and the current image across calls, so a file
+    that is still being written can be parsed piece by piece. finish() closes whichever event is still open, exactly
+    as at the end of a file.
+    """
+
+    def __init__(self, filename):
+        self.session = Session(filename)
+        self._findFloat = re.compile("[+-]?([0-9]*[.])?[0-9]+")  # regex to search for a number (float)
+        self._header = []  # header lines seen so far, until the experiment starts
+        self._imagesByName = None
+        self._wheelHalfTimes = []
+        self._skipLine = False
+        self._curImgName = None
+        self._pokeInProgress = False
+        self._currentImg, self._pokeImg, self._currentState = None, None, None
+
+    @property
+    def started(self):
+        # whether the header has been read and body events are being parsed
+        return self._imagesByName is not None
+
+    def feed(self, lines):
+        lines = iter(lines)
+        if self.started or self.feedHeader(lines):
+            self.feedTokens(tokenize(lines))
+
+    def feedHeader(self, lines):
+        # consume header LINES up to and including the start of the experiment, returning whether it was reached
+        for line in lines:
+            self._header.append(line)
+            if "Start of experiment" in line:
+                self._start()
+                return True
+        return False
+
+    def _start(self):
+        session = self.session
+        imagesByName, identifier, preset, cage = initialize(self._header, session.filename, self._findFloat)
+        session.identifier, session.preset, session.cage = identifier, preset, cage
+        session.setImages(imagesByName.values())
+        images = session.images
+        self._imagesByName, self._header = imagesByName, None
 
-        wb = Workbook()
-        outputCSV = wb.active
         try:
             controlImgStart = [im for im in images if im.imageType == ImageTypes.CONTROL][0]
         except IndexError:
             print("Warning: No CONTROL Images")
-            outputCSV.append(["WARNING: no CONTROL images defined"])
             controlImgStart = [im for im in images][0]
         # ControlImgStart defined in case wheel or door activity is documented prior to first image appearance
         # documentation. This occurs rarely and is a bug in the results file generation protocol.
-
-        currentImg, pokeImg, runImg, currentState = controlImgStart, controlImgStart, controlImgStart, None
-
-        for line in allInput:
-
-            if 'starting' in line:
-                continue
-
-            elif 'Image' in line and 'Name:' in line:
-                newImgName = line[line.find('Name:') + 5: line.find(',')].strip()
-                if curImgName != newImgName:  # ignore if it is the same image (this is a bug)
-                    newImg = next((img for img in images if img.name == newImgName), None)
-                    assert newImg is not None, 'Unrecognized image: {0}'.format(newImgName)
-                    newImg.incrementAppearances(float(re.search("Time: (.*)", line).group(1)), currentImg)
-                    curImgName = newImgName
+        self._currentImg, self._pokeImg = controlImgStart, controlImgStart
+
+    @profiled('parse')
+    def feedTokens(self, tokens):
+        # body events as (device, state, time, name) TOKENS from tokenize() or scanEvents(), once the header is read;
+        # state is held in locals for the duration of the loop and written back afterwards
+        session, events, imagesByName = self.session, self.session.events, self._imagesByName
+        poke_events, rotation_intervals = session.poke_events, session.rotation_intervals
+        wheelHalfTimes, skipLine, curImgName = self._wheelHalfTimes, self._skipLine, self._curImgName
+        pokeInProgress, currentImg, pokeImg, currentState = (self._pokeInProgress, self._currentImg, self._pokeImg,
+                                                             self._currentState)
+
+        for device, state, time, name in tokens:
+
+            if device is Devices.Image:
+                if curImgName != name:  # ignore if it is the same image (this is a bug)
+                    newImg = imagesByName.get(name)
+                    assert newImg is not None, 'Unrecognized image: {0}'.format(name)
+                    session.addAppearance(newImg, time, currentImg)
+                    curImgName = name
                     currentImg = newImg
 
-
-            elif 'Wheel' in line and not pokeInProgress:
+            elif device is Devices.Wheel and not pokeInProgress:
                 if skipLine:
                     skipLine = False
                     continue
                 if currentState is Activity.Poking:
-                    endPoke(doorStates, doorTimes, pumpTimes, pumpStates, pokeImg, poke_events)
-                    doorStates, doorTimes, pumpTimes, pumpStates = [], [], [], []
+                    endPoke(events, pokeImg, poke_events)
                 currentState = Activity.Running
-                if 'State:' in line:
-                    wheelHalfTimes.append(float(findFloat.search(line).group(0)))  # appends times
-                if 'revolution' in line:
+                if state == REVOLUTION:
                     # need to skip next data point because wheel state does not actually change; it appears to be a bug
                     skipLine = True
                     continue  # do NOT reset skipLine boolean
+                wheelHalfTimes.append(time)
 
-            elif 'Pump' in line:
-                if re.search("State: (.*), Time", line).group(1) == 'On':
+            elif device is Devices.Pump:
+                if state == 'On':
                     pump_state = PumpStates.On
-                    pokeImg = currentImg  # the poke event's image should be the image when the pump is on (ie REWARD image)
+                    # the poke event's image should be the image when the pump is on (ie REWARD image)
+                    pokeImg = currentImg
                     pokeInProgress = True  # ensure parameters don't change within poke duration
                 else:
                     pump_state = PumpStates.Off
                     pokeInProgress = False
-                pumpStates.append(pump_state)
-                pumpTimes.append(float(findFloat.search(line).group(0)))
+                events.addPump(pump_state, time)
 
-            elif 'Door' in line:
+            elif device is Devices.Door:
                 if currentState is Activity.Running:
-                    endRun(wheelHalfTimes, currentImg, rotation_intervals)
+                    endRun(events, wheelHalfTimes, currentImg, rotation_intervals)
                     wheelHalfTimes = []
                 if currentState is not Activity.Poking and not pokeInProgress:
                     pokeImg = currentImg  # record image when poke event starts
                 currentState = Activity.Poking
-                door_state = DoorStates.High if re.search("State: (.*), Time", line).group(
-                    1) == 'High' else DoorStates.Low
-                doorStates.append(door_state)
-                doorTimes.append(float(findFloat.search(line).group(0)))
+                events.addDoor(DoorStates.High if state == 'High' else DoorStates.Low, time)
 
             skipLine = False
-        if currentState is Activity.Poking:
-            endPoke(doorStates, doorTimes, pumpTimes, pumpStates, pokeImg, poke_events)
+
+        self._wheelHalfTimes, self._skipLine, self._curImgName = wheelHalfTimes, skipLine, curImgName
+        self._pokeInProgress, self._currentImg, self._pokeImg, self._currentState = (pokeInProgress, currentImg,
+                                                                                     pokeImg, currentState)
+
+    def finish(self):
+        session = self.session
+        if not self.started:
+            raise ValueError('No start of experiment found in {0}'.format(session.filename))
+        if self._currentState is Activity.Poking:
+            endPoke(session.events, self._pokeImg, session.poke_events)
         else:
-            endRun(wheelHalfTimes, currentImg, rotation_intervals)
-        pruneRotationIntervals(rotation_intervals)
+            endRun(session.events, self._wheelHalfTimes, self._currentImg, session.rotation_intervals)
+        self._wheelHalfTimes, self._currentState = [], None
+        return session
+
+
+def parseLines(lines, filename):
+    """
+    Parse an iterable of results-file LINES into a Session. Lines are consumed in a single pass, so a file object is
+    streamed without holding every line in memory.
+    """
+    parser = SessionParser(filename)
+    parser.feed(lines)
+    return parser.finish()
+
+
+def _cachePath(filename, cacheDir):
+    return os.path.join(cacheDir, hashlib.sha1(os.path.abspath(filename).encode()).hexdigest() + '.npz')
+
+
+def fileDigest(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fileKey(filename):
+    stat = os.stat(filename)
+    return {'path': os.path.abspath(filename), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'sha1': fileDigest(filename), 'version': CACHE_VERSION}
+
+
+@profiled('writeCache')
+def writeCache(session, cacheDir=CACHEDIR, key=None):
+    """
+    Save the parsed SESSION to CACHEDIR as a compressed .npz, keyed by the source file's path, size, mtime and SHA-1.
+    KEY is the _fileKey() taken before parsing; it defaults to the file's current key, which only matches SESSION
+    if the file has not changed since it was parsed.
+    """
+    os.makedirs(cacheDir, exist_ok=True)
+    imageList = sorted(session.images, key=lambda im: (im.name, im.imageType.value))
+    imageIndex = {im: i for i, im in enumerate(imageList)}
+    meta = {'key': key or _fileKey(session.filename), 'identifier': session.identifier, 'cage': session.cage,
+            'preset': session.preset.name if isinstance(session.preset, Presets) else session.preset,
+            'images': [[im.name, im.imageType.value] for im in imageList]}
+    appearances = list(session.appearances.values())
+    events = session.events
+    arrays = {'meta': np.array(json.dumps(meta)),
+              'appearanceTimes': np.array([ap.time for ap in appearances], dtype=np.float64),
+              'appearanceImages': np.array([imageIndex[ap.image] for ap in appearances], dtype=np.int32),
+              'pokeImages': np.array([imageIndex[pe.image] for pe in session.poke_events], dtype=np.int32),
+              'pokeAppearanceTimes': np.array([pe.imageAppearanceTime for pe in session.poke_events],
+                                              dtype=np.float64),
+              'runIndices': np.array([ri.index for ri in session.rotation_intervals], dtype=np.int64),
+              'runImages': np.array([imageIndex[ri.image] for ri in session.rotation_intervals], dtype=np.int32)}
+    for column in EventStore.COLUMNS:
+        arrays[column] = getattr(events, column)
+    path = _cachePath(session.filename, cacheDir)
+    descriptor, tempPath = tempfile.mkstemp(dir=cacheDir, suffix='.tmp')  # unique per writer, so workers never collide
+    try:
+        with os.fdopen(descriptor, 'wb') as cacheFile:
+            np.savez_compressed(cacheFile, **arrays)
+        os.chmod(tempPath, 0o644)  # mkstemp makes the file private to its owner
+        os.replace(tempPath, path)  # atomic, so concurrent workers never read a partial cache
+    except BaseException:
+        os.unlink(tempPath)
+        raise
 
-        if genOutput:
-            analysisFuncs(poke_events, rotation_intervals, wb, preset)
-            wb.save(filename.replace(filename[filename.rfind('/') + 1:], identifier + '.xlsx'))
 
-        return poke_events, rotation_intervals, preset, images
+@profiled('readCache')
+def readCache(filename, cacheDir=CACHEDIR, key=None):
+    """
+    Rebuild the Session for FILENAME from CACHEDIR, or return None if there is no cache entry or it is stale or
+    unreadable. KEY is the file's current _fileKey(), computed here if not given.
+    """
+    path = _cachePath(filename, cacheDir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as cached:
+            arrays = {name: cached[name] for name in cached.files}
+        meta = json.loads(str(arrays['meta']))
+        if meta['key'] != (key or _fileKey(filename)):
+            return None
+        return _rebuildSession(filename, meta, arrays)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None  # truncated or corrupt entries are misses, and are overwritten after the file is re-parsed
+
+
+def _rebuildSession(filename, meta, arrays):
+    session = Session(filename)
+    session.identifier, session.cage = meta['identifier'], meta['cage']
+    session.preset = Presets[meta['preset']] if meta['preset'] in Presets.__members__ else meta['preset']
+    imageList = [Image(name, ImageTypes(imageType)) for name, imageType in meta['images']]
+    session.setImages(imageList)
+    previous = None
+    for time, i in zip(arrays['appearanceTimes'].tolist(), arrays['appearanceImages'].tolist()):
+        session.addAppearance(imageList[i], time, previous or imageList[i])  # replay to recover reward sequence
+        previous = imageList[i]
+    session.events = events = EventStore.fromColumns({column: arrays[column] for column in EventStore.COLUMNS})
+    session.poke_events = [PokeEvent(events, index, imageList[i], appearanceTime) for index, (i, appearanceTime) in
+                           enumerate(zip(arrays['pokeImages'].tolist(), arrays['pokeAppearanceTimes'].tolist()))]
+    session.rotation_intervals = [RotationInterval(events, index, imageList[i]) for index, i in
+                                  zip(arrays['runIndices'].tolist(), arrays['runImages'].tolist())]
+    return session
+
+
+def loadSession(filename, cacheDir=CACHEDIR):
+    """
+    Session for FILENAME, read from the parse cache in CACHEDIR when valid and parsed (then cached) otherwise. A
+    CACHEDIR of None disables caching.
+    """
+    if cacheDir is None:
+        return parseFile(filename)
+    # keyed before parsing, so a file that grows meanwhile is never cached under a key newer than its contents
+    key = _fileKey(filename)
+    session = readCache(filename, cacheDir, key)
+    if session is not None:
+        return session
+    session = parseFile(filename)
+    writeCache(session, cacheDir, key)
+    return session
+
+
+def analyzeFile(filename, genOutput=True, cacheDir=CACHEDIR, formats=FORMATS, profile=None):
+    """
+    Load a single results file and, if GENOUTPUT is set, run analysisFuncs and write its output alongside the file in
+    each of FORMATS. Exceptions are propagated to the caller.
+    PROFILE is a set of profiling modes (see profiling.PROFILE_MODES) and defaults to those named by the
+    BEHAVIOR_PROFILE environment variable. When any are on, each stage is timed and the report is kept in the
+    Session's PROFILE and written to <identifier>_profile.json beside the output; if the file fails, the report of
+    the stages run so far is attached to the exception as its PROFILE.
+    """
+    profile = environmentModes() if profile is None else profile
+    profiler = StageProfiler(filename, profile) if profile else None
+    try:
+        with profiler or contextlib.nullcontext():
+            session = loadSession(filename, cacheDir)
+
+            if genOutput:
+                backends = openBackends(formats, os.path.join(os.path.dirname(filename), session.identifier))
+                wb = next((b.workbook for b in backends if b.workbook is not None), None)
+                tables = OrderedDict()
+                if wb is not None and not any(im.imageType == ImageTypes.CONTROL for im in session.images):
+                    wb.active.append(["WARNING: no CONTROL images defined"])
+                analysisFuncs(session, wb, tables)
+                for backend in backends:
+                    with stage('save'):
+                        for name, (headings, rows) in tables.items():
+                            backend.writeTable(name, headings, rows)
+                        session.outputPaths.extend(backend.close())
+    except Exception as e:
+        if profiler is not None:
+            e.profile = profiler.report()
+        raise
+
+    if profiler is not None:
+        session.profile = profiler.report()
+        session.outputPaths.extend(profiler.write(os.path.join(os.path.dirname(filename), session.identifier)))
+    return session
+
+
+def analyze(fileList, genOutput=True, cacheDir=CACHEDIR, formats=FORMATS, profile=None):
+    """
+    Analyze every file in FILELIST, returning a list of Sessions in the same order. A file that fails to parse or
+    analyze is reported and recorded in its Session's ERROR field; the remaining files are still processed.
+    """
+    sessions = []
+    for filename in fileList:
+        try:
+            session = analyzeFile(filename, genOutput, cacheDir, formats, profile)
+        except Exception as e:
+            print("Failed to analyze {0}: {1!r}".format(filename, e))
+            traceback.print_exc()
+            session = Session(filename)
+            session.error = e
+            session.profile = getattr(e, 'profile', None)
+        sessions.append(session)
+    return sessions
+
+
+def summarize(session):
+    """
+    Condense a Session into a small, picklable record suitable for returning from worker processes.
+    """
+    return {'filename': session.filename,
+            'identifier': session.identifier,
+            'preset': session.preset.name if isinstance(session.preset, Presets) else session.preset,
+            'outputPaths': session.outputPaths,
+            'pokeEvents': len(session.poke_events),
+            'rotationIntervals': len(session.rotation_intervals),
+            'profile': session.profile,
+            'error': repr(session.error) if session.error is not None else None}
+
+
+def _analyzeWorker(filename, genOutput, cacheDir, formats, profile):
+    # runs in a child process; only the summary is sent back to avoid pickling the full event graph
+    return summarize(analyze([filename], genOutput, cacheDir, formats, profile)[0])
+
+
+def analyzeParallel(fileList, workers=None, genOutput=True, cacheDir=CACHEDIR, formats=FORMATS, profile=None):
+    """
+    Analyze FILELIST across a pool of WORKERS processes (defaults to the number of CPUs). Each worker parses its file,
+    runs analysisFuncs and writes its output; summaries are returned in the order of FILELIST.
+    """
+    n = len(fileList)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_analyzeWorker, fileList, [genOutput] * n, [cacheDir] * n, [formats] * n,
+                             [profile] * n))
+
+
+def printSummary(summaries):
+    failed = [s for s in summaries if s['error'] is not None]
+    print("\nAnalyzed {0} of {1} files".format(len(summaries) - len(failed), len(summaries)))
+    for s in failed:
+        print("FAILED: {0} >> {1}".format(s['filename'], s['error']))
 
 
 '''ANALYSIS FUNCTION CALLS BEGIN HERE; DO NOT EDIT ABOVE WHEN RUNNING ANALYSIS. CHANGES SHOULD BE MADE ONLY TO 
 analysisFuncs METHOD BELOW.'''
 
 
-def analysisFuncs(poke_events, rotation_intervals, wb, preset):
-    ws = wb.active
-    pokeLatencies(preset, wb)
-    pokesPerHour(poke_events, ws)  # Note that 'ws' is the first sheet in the workbook 'wb'.
-    analyzeRotations(rotation_intervals, wb)
+def analysisFuncs(session, wb, tables=None):
+    # WB is None when no Excel output was requested; TABLES collects the named tables for the other backends
+    ws = wb.active if wb is not None else None
+    pokeLatencies(session, wb, tables)
+    pokesPerHour(session.poke_events, ws, tables)  # Note that 'ws' is the first sheet in the workbook 'wb'.
+    analyzeRotations(session.rotation_intervals, wb, tables)
 
 if __name__ == "__main__":
-    if not LOCALDIR.endswith('/'):
-        LOCALDIR += '/'
-    analyze(getFileNames(LOCALDIR))
+    parser = argparse.ArgumentParser(description='Analyze behavioral results files.')
+    parser.add_argument('location', nargs='?', default=LOCALDIR, help='directory searched recursively for results')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of worker processes; 0 uses every CPU (default: 1, serial)')
+    parser.add_argument('--no-cache', action='store_true', help='always re-parse results files')
+    parser.add_argument('-f', '--format', action='append', choices=list(BACKENDS), dest='formats',
+                        help='output format; repeat for several (default: xlsx)')
+    parser.add_argument('--profile', nargs='?', const='time', type=profileModes,
+                        help='time each stage per file, plus comma-separated "memory" (tracemalloc peaks) and '
+                             '"cprofile"; written as <identifier>_profile.json and a combined profile.json in LOCATION '
+                             '(default: the BEHAVIOR_PROFILE environment variable)')
+    args = parser.parse_args()
+    if args.profile is None:
+        try:
+            args.profile = profileModes(os.environ.get(PROFILE_ENV))
+        except ValueError as e:
+            parser.error('{0}: {1}'.format(PROFILE_ENV, e))
+    location = args.location if args.location.endswith('/') else args.location + '/'
+    fileList = getFileNames(location)
+    cacheDir = None if args.no_cache else CACHEDIR
+    formats = tuple(args.formats or FORMATS)
+    if args.workers == 1:
+        summaries = [summarize(s) for s in analyze(fileList, cacheDir=cacheDir, formats=formats, profile=args.profile)]
+    else:
+        summaries = analyzeParallel(fileList, args.workers or None, cacheDir=cacheDir, formats=formats,
+                                    profile=args.profile)
+    printSummary(summaries)
+    if args.profile:
+        reportPath = os.path.join(location, 'profile.json')
+        writeBatchReport(summaries, reportPath)
+        print("Profile report: {0}".format(reportPath))
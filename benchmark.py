@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import gc
+import io
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from analyzeBehavioral import *
+from synthetic import NIGHT_HOURS, writeResults
+
+"""
+Number of timed repetitions per benchmark; the best run is reported.
+"""
+REPEATS = 3
+
+
+def legacyTokenize(lines):
+    """
+    Reference implementation of the per-line substring checks and regex searches used by the parse loop before
+    tokenize() was introduced. Yields the same tuples as tokenize() so the two can be compared directly.
+    """
+    findFloat = re.compile("[+-]?([0-9]*[.])?[0-9]+")
+    for line in lines:
+        if 'starting' in line:
+            continue
+        elif 'Image' in line and 'Name:' in line:
+            name = line[line.find('Name:') + 5: line.find(',')].strip()
+            yield Devices.Image, None, float(re.search("Time: (.*)", line).group(1)), name
+        elif 'Wheel' in line:
+            if 'State:' in line:
+                yield Devices.Wheel, re.search("State: (.*), Time", line).group(1), \
+                      float(findFloat.search(line).group(0)), None
+            elif 'revolution' in line:
+                yield Devices.Wheel, REVOLUTION, None, None
+            else:
+                yield None, None, None, None
+        elif 'Pump' in line:
+            yield (Devices.Pump, re.search("State: (.*), Time", line).group(1), float(findFloat.search(line).group(0)),
+                   None)
+        elif 'Door' in line:
+            yield (Devices.Door, re.search("State: (.*), Time", line).group(1), float(findFloat.search(line).group(0)),
+                   None)
+        else:
+            yield None, None, None, None
+
+
+def legacyFilterRun(halfTimes):
+    """
+    Reference implementation of the original RotationInterval speed filtering, returning the kept half-times and
+    their instantaneous RPMs.
+    """
+    raw_rpms = []
+    for i in range(1, len(halfTimes) - 1):
+        raw_rpms.append(60 / (halfTimes[i + 1] - halfTimes[i - 1]))
+    raw_rpms.insert(0, 30 / (halfTimes[1] - halfTimes[0]))
+    raw_rpms.append(30 / (halfTimes[-1] - halfTimes[-2]))
+    erratic = []
+    for i in range(1, len(halfTimes) - 1):
+        if raw_rpms[i] > 200:
+            erratic.append(i)
+    keptTimes, keptRPMs = [], []
+    for i in range(1, len(halfTimes) - 1):
+        if i not in erratic:
+            keptRPMs.append(raw_rpms[i])
+            keptTimes.append(halfTimes[i])
+    return keptTimes, keptRPMs
+
+
+def syntheticBout(numHalfTimes, rng):
+    # half-rotations at roughly 40-80 RPM with occasional sensor bounces that read as >200 RPM
+    gaps = rng.uniform(0.375, 0.75, numHalfTimes)
+    gaps[rng.random(numHalfTimes) < 0.05] = 0.01
+    return list(np.cumsum(gaps) + 1000.0)
+
+
+def syntheticImageLog(numImages=60, numSwitches=20000, seed=0):
+    """
+    Lines of a CONTRAST-style results file with NUMIMAGES images (one CONTROL, the rest REWARD) whose body is
+    dominated by NUMSWITCHES image switches, each followed by a short poke.
+    """
+    rng = np.random.default_rng(seed)
+    control = 'Solid.png'
+    rewards = ['Checkerboard-contrast_{0}.png'.format(i) for i in range(1, numImages)]
+    lines = ['Experiment preset: Contrast\n', 'USB drive ID: CAGE 1A\n',
+             'Control image set: [{0}]\n'.format(control), 'Reward image set: [{0}]\n'.format(', '.join(rewards)),
+             '-------------------------------Start of experiment---------------------------\n']
+    names = [control] + rewards
+    t = 1.0
+    for i in rng.integers(0, numImages, numSwitches):
+        lines.append('Image - Name: {0}, Hash: 0123456789abcdef, Time: {1:.3f}\n'.format(names[i], t))
+        lines.append('Door - State: Low, Time: {0:.3f}\n'.format(t + 0.5))
+        lines.append('Door - State: High, Time: {0:.3f}\n'.format(t + 0.6))
+        t += 2.0
+    return lines
+
+
+def bestOf(func, *args):
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def consume(tokenizer, lines):
+    for _ in tokenizer(lines):
+        pass
+
+
+def benchmarkTokenizer(fileList):
+    lines = []
+    for filename in fileList:
+        with open(filename, 'r') as resultFile:
+            body = resultFile.readlines()
+        assert list(tokenize(body)) == list(legacyTokenize(body)), 'tokenizer mismatch in {0}'.format(filename)
+        lines.extend(body)
+
+    data = ''.join(lines).encode()
+    assert list(scanEvents(data)) == list(tokenize(lines)), 'bytes scanner mismatch'
+
+    legacy = bestOf(consume, legacyTokenize, lines)
+    compiled = bestOf(consume, tokenize, lines)
+    scanned = bestOf(consume, scanEvents, data)
+    print("Tokenizer over {0} lines from {1} files".format(len(lines), len(fileList)))
+    print("legacy substring/regex scan >> {0:,.0f} lines/sec".format(len(lines) / legacy))
+    print("compiled single-pass tokenizer >> {0:,.0f} lines/sec ({1:.2f}x)".format(len(lines) / compiled,
+                                                                                 legacy / compiled))
+    print("bytes findall over the buffer >> {0:,.0f} lines/sec ({1:.2f}x)".format(len(lines) / scanned,
+                                                                                 legacy / scanned))
+
+
+def parseText(fileList):
+    for filename in fileList:
+        with open(filename, 'r') as resultFile:
+            parseLines(resultFile, filename)
+
+
+def parseMapped(fileList):
+    for filename in fileList:
+        parseMappedFile(filename)
+
+
+def benchmarkParse(fileList):
+    # whole-file parses, reading decoded text lines against scanning the memory-mapped bytes
+    size = sum(os.path.getsize(filename) for filename in fileList)
+    with contextlib.redirect_stdout(io.StringIO()):
+        text = bestOf(parseText, fileList)
+        mapped = bestOf(parseMapped, fileList)
+    print("Parsing {0:.1f} MB in {1} files".format(size / 1e6, len(fileList)))
+    print("text lines {0:.0f} MB/s, memory-mapped bytes {1:.0f} MB/s ({2:.2f}x)".format(
+        size / 1e6 / text, size / 1e6 / mapped, text / mapped))
+
+
+def benchmarkRotations(lengths=(10, 100, 1000, 5000)):
+    rng = np.random.default_rng(0)
+    print("Rotation interval filtering")
+    for length in lengths:
+        bout = syntheticBout(length, rng)
+        events = EventStore()
+        ri = RotationInterval(events, events.addRun(bout), None)
+        keptTimes, keptRPMs = legacyFilterRun(bout)
+        assert list(ri.halfTimes) == keptTimes and list(ri.speeds) == keptRPMs, 'rotation mismatch'
+
+        legacy = bestOf(legacyFilterRun, bout)
+        vectorized = bestOf(EventStore().addRun, bout)
+        print("{0} half-times >> legacy {1:.3f} ms, vectorized {2:.3f} ms ({3:.1f}x)".format(
+            length, legacy * 1000, vectorized * 1000, legacy / vectorized))
+
+
+def benchmarkImageResolution(numImages=60, numSwitches=20000):
+    lines = syntheticImageLog(numImages, numSwitches)
+    names = [name for device, _, _, name in tokenize(lines) if device is Devices.Image]
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'Results - synthetic.txt')
+        with open(filename, 'w') as resultFile:
+            resultFile.writelines(lines)
+        with contextlib.redirect_stdout(io.StringIO()):
+            imagesByName = initialize(lines, filename, re.compile("[+-]?([0-9]*[.])?[0-9]+"))[0]
+            parse = bestOf(analyzeFile, filename, False, None)
+    images = set(imagesByName.values())
+
+    def linearScan():
+        for name in names:
+            next((img for img in images if img.name == name), None)
+
+    def hashLookup():
+        for name in names:
+            imagesByName.get(name)
+
+    legacy = bestOf(linearScan)
+    hashed = bestOf(hashLookup)
+    print("Image resolution over {0} switches among {1} images".format(len(names), numImages))
+    print("linear scan {0:.1f} ms, name map {1:.1f} ms ({2:.0f}x); full parse {3:.1f} ms".format(
+        legacy * 1000, hashed * 1000, legacy / hashed, parse * 1000))
+
+
+"""
+Classes given fixed __slots__ layouts, compared by benchmarkObjects against __dict__ twins of themselves.
+"""
+EVENT_CLASSES = ('Appearance', 'PokeEvent', 'RotationInterval', 'Image', 'ImageStats')
+
+
+def unslotted(cls):
+    # twin of CLS with the same methods but a per-instance __dict__ in place of its slots
+    namespace = {k: v for k, v in vars(cls).items() if k != '__slots__' and k not in cls.__slots__}
+    return type(cls.__name__, cls.__bases__, namespace)
+
+
+@contextlib.contextmanager
+def unslottedClasses():
+    # parse with the __dict__ twins by swapping them in where analyzeBehavioral looks its classes up
+    module = sys.modules['analyzeBehavioral']
+    saved = {name: getattr(module, name) for name in EVENT_CLASSES}
+    try:
+        for name, cls in saved.items():
+            setattr(module, name, unslotted(cls))
+        yield
+    finally:
+        for name, cls in saved.items():
+            setattr(module, name, cls)
+
+
+def instanceSize(obj):
+    return sys.getsizeof(obj) + (sys.getsizeof(vars(obj)) if hasattr(obj, '__dict__') else 0)
+
+
+def sessionFootprint(filename):
+    """
+    Bytes still allocated once FILENAME is parsed and its image statistics computed, the best parse time, and the
+    Session.
+    """
+    parse = bestOf(parseFile, filename)
+    gc.collect()
+    tracemalloc.start()
+    session = parseFile(filename)
+    pokeLatencies(session)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, parse, session
+
+
+def benchmarkObjects(hours=NIGHT_HOURS, boutsPerHour=200, revolutionsPerBout=12):
+    """
+    Memory and parse time of a busy night, one where every short wheel bout starts a rotation interval, a reward
+    appearance and a poke event, with the event classes slotted, as they are, and with __dict__ twins of them.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = writeResults(tmp, hours=hours, boutsPerHour=boutsPerHour, revolutionsPerBout=revolutionsPerBout,
+                                minRevolutions=revolutionsPerBout // 2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            with unslottedClasses():
+                legacySize, legacyParse, legacy = sessionFootprint(filename)
+            size, parse, session = sessionFootprint(filename)
+    print("Event objects of a {0}-hour night: {1:,} poke events, {2:,} rotation intervals, {3:,} appearances".format(
+        hours, len(session.poke_events), len(session.rotation_intervals), len(session.appearances)))
+    print("__dict__ {0:.2f} MB, parse {1:.1f} ms >> __slots__ {2:.2f} MB ({3:.0%} less), parse {4:.1f} ms".format(
+        legacySize / 1e6, legacyParse * 1000, size / 1e6, 1 - size / legacySize, parse * 1000))
+    samples = [('Appearance', next(iter(legacy.appearances.values())), next(iter(session.appearances.values()))),
+               ('PokeEvent', legacy.poke_events[0], session.poke_events[0]),
+               ('RotationInterval', legacy.rotation_intervals[0], session.rotation_intervals[0])]
+    print(", ".join("{0} {1} -> {2} bytes".format(name, instanceSize(old), instanceSize(new))
+                    for name, old, new in samples))
+
+
+def peakRSS():
+    """
+    Peak resident set size of this process in MB. Linux's VmHWM is preferred since ru_maxrss survives exec and so can
+    report the parent's peak in a spawned child; ru_maxrss is in kB on Linux and bytes on macOS.
+    """
+    try:
+        with open('/proc/self/status', 'r') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def runStages(filename):
+    """
+    Time each stage of analyzeFile on FILENAME in pipeline order: parsing, pokeLatencies, pokesPerHour,
+    analyzeRotations and saving the workbook. Returns the number of lines, the timings and the peak RSS.
+    """
+    with open(filename, 'r') as resultFile:
+        numLines = sum(1 for _ in resultFile)
+    timings = OrderedDict()
+
+    def stage(name, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        timings[name] = time.perf_counter() - start
+        return result
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        session = stage('parse', parseFile, filename)
+        backend = BACKENDS['xlsx'](os.path.join(os.path.dirname(filename), session.identifier))
+        wb = backend.workbook
+        stage('pokeLatencies', pokeLatencies, session, wb)
+        stage('pokesPerHour', pokesPerHour, session.poke_events, wb.active)
+        stage('analyzeRotations', analyzeRotations, session.rotation_intervals, wb)
+        stage('save', backend.close)
+    return numLines, timings, peakRSS()
+
+
+def benchmarkStages(scales=(1, 10, 100)):
+    """
+    Run every stage on synthetic sessions of 1x, 10x, ... a night. Each size runs in a freshly spawned process so its
+    peak RSS is its own.
+    """
+    print("Analysis stages on synthetic {0}-hour nights".format(NIGHT_HOURS))
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            filename = writeResults(os.path.join(tmp, str(scale)), hours=NIGHT_HOURS * scale)
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                numLines, timings, peak = pool.submit(runStages, filename).result()
+            total = sum(timings.values())
+            print("{0}x ({1:,} lines) >> {2:.2f} s, {3:,.0f} lines/sec, peak RSS {4:.0f} MB".format(
+                scale, numLines, total, numLines / total, peak))
+            for name, seconds in timings.items():
+                print("  {0:<16} {1:8.3f} s {2:>14,.0f} lines/sec".format(name, seconds, numLines / seconds))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark parsing and analysis.')
+    parser.add_argument('files', nargs='*', help='results files for the tokenizer benchmark (default: all of Data/)')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help='synthetic session sizes in nights for the stage benchmark (default: 1 10 100)')
+    args = parser.parse_args()
+    fileList = args.files or getFileNames(LOCALDIR)
+    benchmarkTokenizer(fileList)
+    benchmarkParse(fileList)
+    benchmarkRotations()
+    benchmarkImageResolution()
+    benchmarkObjects()
+    benchmarkStages(args.scales)
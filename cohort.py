@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import argparse
+from outputBackends import BACKENDS
+from analyzeBehavioral import *
+
+"""
+Columns of the long-format cohort table. KIND is 'poke' for a poke event, 'miss' for a REWARD image appearance that
+timed out without a poke and 'rotation' for a wheel rotation interval; fields that do not apply to a kind are empty.
+"""
+COHORT_COLUMNS = ['cohort', 'night', 'cage', 'mouse', 'preset', 'file', 'kind', 'image', 'image_type', 'contrast',
+                  'time', 'appearance_time', 'latency', 'success', 'rotations', 'rpm']
+
+"""
+Columnar formats the cohort table can be written in.
+"""
+COHORT_FORMATS = ('parquet', 'arrow', 'csv')
+
+
+def sessionRows(session):
+    """
+    Long-format rows for every poke event, timed out REWARD appearance and rotation interval of SESSION, in that order.
+    """
+    cohort, night = directoryMetadata(session.filename)
+    preset = session.preset.name if isinstance(session.preset, Presets) else session.preset or None
+    common = [cohort, night, session.cage, session.identifier, preset, session.filename]
+    rows = []
+    for pe in session.poke_events:
+        rows.append(common + ['poke', pe.image.name, pe.image.imageType.value, getContrast(pe.image), pe.startTime,
+                              pe.imageAppearanceTime, pe.latency, pe.isSuccess(), None, None])
+    timeout = TIMEOUTS.get(session.preset)
+    for ap in session.appearances.values():
+        if ap.image.imageType is ImageTypes.REWARD and not ap.poke_events and timeout is not None:
+            rows.append(common + ['miss', ap.image.name, ap.image.imageType.value, getContrast(ap.image), ap.time,
+                                  ap.time, float(timeout), False, None, None])
+    for ri in session.rotation_intervals:
+        rows.append(common + ['rotation', ri.image.name, ri.image.imageType.value, getContrast(ri.image),
+                              ri.startTime, None, None, None, ri.numRotations(), ri.avgSpeed])
+    return rows
+
+
+def _cohortWorker(filename, cacheDir):
+    # runs in a child process; rows are plain lists so they pickle cheaply
+    try:
+        return sessionRows(loadSession(filename, cacheDir)), None
+    except Exception as e:
+        return [], repr(e)
+
+
+def buildCohort(fileList, workers=1, cacheDir=CACHEDIR):
+    """
+    Long-format rows for every file in FILELIST, loaded across WORKERS processes (0 uses every CPU). Files that fail
+    to parse are reported and left out.
+    """
+    if workers == 1:
+        results = map(_cohortWorker, fileList, [cacheDir] * len(fileList))
+    else:
+        with ProcessPoolExecutor(max_workers=workers or None) as pool:
+            results = list(pool.map(_cohortWorker, fileList, [cacheDir] * len(fileList)))
+    rows = []
+    for filename, (fileRows, error) in zip(fileList, results):
+        if error is not None:
+            print("Failed to load {0}: {1}".format(filename, error))
+        rows.extend(fileRows)
+    return rows
+
+
+def writeCohort(rows, basePath, fmt='parquet'):
+    """
+    Write the cohort table to <basePath>_events.<ext> in FMT, one of COHORT_FORMATS. Returns the path written.
+    """
+    if fmt not in COHORT_FORMATS:
+        raise ValueError('cohort tables are written as one of {0}'.format(', '.join(COHORT_FORMATS)))
+    backend = BACKENDS[fmt](basePath)
+    backend.writeTable('events', COHORT_COLUMNS, rows)
+    return backend.close()[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Consolidate every results file under a directory into one table.')
+    parser.add_argument('location', nargs='?', default=LOCALDIR, help='directory searched recursively for results')
+    parser.add_argument('-o', '--output', help='output path without extension (default: <location>/cohort)')
+    parser.add_argument('-f', '--format', choices=COHORT_FORMATS, default='parquet')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of worker processes; 0 uses every CPU (default: 1, serial)')
+    parser.add_argument('--no-cache', action='store_true', help='always re-parse results files')
+    args = parser.parse_args()
+    location = args.location if args.location.endswith('/') else args.location + '/'
+    rows = buildCohort(getFileNames(location), args.workers, None if args.no_cache else CACHEDIR)
+    path = writeCohort(rows, args.output or os.path.join(location, 'cohort'), args.format)
+    print("Wrote {0} rows to {1}".format(len(rows), path))
@@ -0,0 +1,71 @@
+import math
+from functools import lru_cache
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def binEdges(timeout, step):
+    """
+    Edges 0, STEP, 2 * STEP, ... of the latency bins for a preset's TIMEOUT, up to the first multiple of STEP at or
+    above TIMEOUT, so a latency of TIMEOUT is binned even when STEP does not divide it. Each edge is the double nearest
+    its decimal value (0.3 rather than 0.30000000000000004), so bins are the same wherever they are computed. Edges are
+    cached per (timeout, step) and returned read-only.
+    """
+    numBins = max(1, math.ceil(timeout / step - 1e-9))  # the tolerance keeps 10 / 0.1 at 100 bins
+    edges = np.round(np.arange(numBins + 1) * step, 12)
+    edges.setflags(write=False)
+    return edges
+
+
+def binIndices(latencies, edges):
+    """
+    Index of the bin of EDGES holding each of LATENCIES, or -1 for latencies outside [edges[0], edges[-1]]. Bin i holds
+    [edges[i], edges[i + 1]) and the last bin also holds edges[-1], as with np.histogram. Indices come from integer
+    division by the step, corrected by one where rounding put a latency on the wrong side of an edge.
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    numBins = len(edges) - 1
+    inRange = (latencies >= edges[0]) & (latencies <= edges[-1])
+    with np.errstate(invalid='ignore'):
+        indices = np.floor((latencies - edges[0]) / (edges[1] - edges[0]))
+    indices = np.clip(np.nan_to_num(indices), 0, numBins - 1).astype(np.int64)
+    indices -= latencies < edges[indices]
+    indices += (indices < numBins - 1) & (latencies >= edges[np.minimum(indices + 1, numBins)])
+    return np.where(inRange, indices, -1)
+
+
+def binIndex(latency, edges):
+    """
+    binIndices for the single float LATENCY, with EDGES as a list, for per-value updates without a NumPy round trip.
+    """
+    if not edges[0] <= latency <= edges[-1]:  # also rejects NaN
+        return -1
+    numBins = len(edges) - 1
+    index = min(int((latency - edges[0]) / (edges[1] - edges[0])), numBins - 1)
+    if latency < edges[index]:
+        index -= 1
+    elif index < numBins - 1 and latency >= edges[index + 1]:
+        index += 1
+    return index
+
+
+def latencyHistograms(latenciesByKey, timeout, steps):
+    """
+    Histograms of every list in LATENCIESBYKEY over [0, TIMEOUT], for each bin width in STEPS, in one grouped pass:
+    the lists are concatenated once and each width takes a single np.bincount over combined key x bin codes. Returns
+    {step: (edges, {key: counts})}.
+    """
+    keys = list(latenciesByKey)
+    lengths = [len(latenciesByKey[key]) for key in keys]
+    latencies = np.concatenate([np.asarray(latenciesByKey[key], dtype=np.float64) for key in keys] or [[]])
+    codes = np.repeat(np.arange(len(keys)), lengths)
+    histograms = {}
+    for step in steps:
+        edges = binEdges(timeout, step)
+        numBins = len(edges) - 1
+        indices = binIndices(latencies, edges)
+        valid = indices >= 0
+        counts = np.bincount(codes[valid] * numBins + indices[valid], minlength=len(keys) * numBins)
+        counts = counts.reshape(len(keys), numBins)
+        histograms[step] = edges, {key: counts[i] for i, key in enumerate(keys)}
+    return histograms
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+from outputBackends import BACKENDS
+from analyzeBehavioral import *
+
+"""
+Bin size for latency frequency distributions.
+"""
+LATENCYSTEP = 0.25
+
+"""
+Columns of the consolidated tables written by writeSensitivity.
+"""
+SENSITIVITY_COLUMNS = ['pair', 'vehicle', 'drug', 'contrast', 'image', 'vehicle_n', 'drug_n', 'vehicle_mean',
+                       'drug_mean', 'd_prime']
+HISTOGRAM_COLUMNS = ['pair', 'contrast', 'image', 'bin', 'vehicle_count', 'drug_count']
+
+
+def readManifest(manifest):
+    """
+    (name, vehicle, drug) for each row of the CSV MANIFEST, which has 'vehicle' and 'drug' columns and optionally
+    'name'. Relative paths are taken relative to the manifest; unnamed pairs are numbered. Raises ValueError if
+    either column is missing or a row leaves one of them empty.
+    """
+    root = os.path.dirname(os.path.abspath(manifest))
+    pairs = []
+    with open(manifest, 'r', newline='') as manifestFile:
+        reader = csv.DictReader(manifestFile)
+        missing = [column for column in ('vehicle', 'drug') if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError("{0} has no {1} column".format(manifest, ' or '.join(repr(c) for c in missing)))
+        for i, row in enumerate(reader):
+            paths = [(row[column] or '').strip() for column in ('vehicle', 'drug')]
+            if not all(paths):
+                raise ValueError("{0}, line {1}: both 'vehicle' and 'drug' are required".format(manifest,
+                                                                                               reader.line_num))
+            vehicle, drug = (os.path.join(root, path) for path in paths)
+            pairs.append(((row.get('name') or '').strip() or 'pair_{0}'.format(i + 1), vehicle, drug))
+    return pairs
+
+
+def fileLatencies(filename, cacheDir=CACHEDIR, step=LATENCYSTEP):
+    """
+    All-latencies of every REWARD image of FILENAME, keyed by image name, with their histograms binned by STEP up to
+    the preset's timeout. Only plain lists and arrays are returned, so the result is cheap to send between processes.
+    """
+    session = loadSession(filename, cacheDir)
+    latencies = {im.name: im.stats.all_latencies for im in session.rewardImages()}
+    edges, counts = latencyHistograms(latencies, TIMEOUTS.get(session.preset, 10), [step])[step]
+    return {'latencies': latencies, 'edges': edges.tolist(), 'counts': {name: c.tolist() for name, c in counts.items()},
+            'contrasts': {im.name: getContrast(im) for im in session.rewardImages()}}
+
+
+def _fileWorker(filename, cacheDir, step):
+    # runs in a child process; failures are returned rather than raised so one bad file does not stop the batch
+    try:
+        return fileLatencies(filename, cacheDir, step), None
+    except Exception as e:
+        return None, repr(e)
+
+
+def dPrime(latenciesD, latenciesV):
+    return np.abs(np.mean(latenciesD) - np.mean(latenciesV)) / np.sqrt(np.var(latenciesD) + np.var(latenciesV))
+
+
+def comparePair(name, vehicleFile, drugFile, vehicle, drug):
+    """
+    Sensitivity and histogram rows for one pair from the fileLatencies() of its VEHICLE and DRUG files.
+    """
+    if set(vehicle['latencies']) != set(drug['latencies']):
+        raise ValueError("Please ensure vehicle and drug experimental image sets are the same. "
+                         "\nVehicle file: {0}\nDrug file:{1}".format(vehicleFile, drugFile))
+    sensitivity, histograms = [], []
+    hbin = drug['edges'] if len(drug['edges']) > len(vehicle['edges']) else vehicle['edges']
+    for image in sorted(drug['latencies'], key=lambda image: drug['contrasts'][image]):
+        latenciesD, latenciesV = drug['latencies'][image], vehicle['latencies'][image]
+        contrast = drug['contrasts'][image]
+        sensitivity.append([name, vehicleFile, drugFile, contrast, image, len(latenciesV), len(latenciesD),
+                            float(np.mean(latenciesV)), float(np.mean(latenciesD)),
+                            float(dPrime(latenciesD, latenciesV))])
+        for countV, countD, edge in zip_longest(vehicle['counts'][image], drug['counts'][image], hbin[:-1],
+                                                fillvalue=0):
+            histograms.append([name, contrast, image, edge, countV, countD])
+    return sensitivity, histograms
+
+
+def batchDPrime(pairs, workers=None, cacheDir=CACHEDIR, step=LATENCYSTEP):
+    """
+    Compare every (name, vehicle, drug) in PAIRS. Each distinct file is parsed once, across a pool of WORKERS
+    processes (defaults to the number of CPUs), and shared by every pair it appears in. Returns the sensitivity and
+    histogram rows of all pairs that could be compared; failed pairs are reported and skipped.
+    """
+    fileList = sorted(set(f for _, vehicle, drug in pairs for f in (vehicle, drug)))
+    n = len(fileList)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = dict(zip(fileList, pool.map(_fileWorker, fileList, [cacheDir] * n, [step] * n)))
+
+    sensitivity, histograms = [], []
+    for name, vehicleFile, drugFile in pairs:
+        (vehicle, vehicleError), (drug, drugError) = results[vehicleFile], results[drugFile]
+        try:
+            if vehicleError or drugError:
+                raise ValueError(vehicleError or drugError)
+            pairSensitivity, pairHistograms = comparePair(name, vehicleFile, drugFile, vehicle, drug)
+        except ValueError as e:
+            print("FAILED: {0} >> {1}".format(name, e))
+            continue
+        sensitivity.extend(pairSensitivity)
+        histograms.extend(pairHistograms)
+    return sensitivity, histograms
+
+
+def writeSensitivity(sensitivity, histograms, basePath, fmt='xlsx'):
+    """
+    Write the consolidated sensitivity and histogram tables to BASEPATH, as one workbook with a sheet per table for
+    xlsx and as <basePath>_sensitivity and <basePath>_histograms otherwise. Returns the paths written.
+    """
+    tables = [('sensitivity', SENSITIVITY_COLUMNS, sensitivity), ('histograms', HISTOGRAM_COLUMNS, histograms)]
+    backend = BACKENDS[fmt](basePath)
+    if backend.workbook is not None:
+        for i, (name, headings, rows) in enumerate(tables):
+            ws = backend.workbook.active if i == 0 else backend.workbook.create_sheet()
+            ws.title = name.capitalize()
+            ws.append(headings)
+            for row in rows:
+                ws.append(row)
+    else:
+        for name, headings, rows in tables:
+            backend.writeTable(name, headings, rows)
+    return backend.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute d' for many vehicle/drug pairs.")
+    parser.add_argument('manifest', help="CSV with 'vehicle' and 'drug' columns and an optional 'name' column")
+    parser.add_argument('-o', '--output', help='output path without extension (default: dprime beside the manifest)')
+    parser.add_argument('-f', '--format', choices=list(BACKENDS), default='xlsx')
+    parser.add_argument('-j', '--workers', type=int, default=0, help='number of worker processes (default: every CPU)')
+    parser.add_argument('--step', type=float, default=LATENCYSTEP,
+                        help='histogram bin width in seconds (default: {0})'.format(LATENCYSTEP))
+    parser.add_argument('--no-cache', action='store_true', help='always re-parse results files')
+    args = parser.parse_args()
+    try:
+        pairs = readManifest(args.manifest)
+    except ValueError as e:
+        parser.error(str(e))
+    sensitivity, histograms = batchDPrime(pairs, args.workers or None, None if args.no_cache else CACHEDIR, args.step)
+    basePath = args.output or os.path.join(os.path.dirname(args.manifest), 'dprime')
+    for path in writeSensitivity(sensitivity, histograms, basePath, args.format):
+        print("Wrote {0}".format(path))
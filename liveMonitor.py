@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import argparse
+import io
+import time
+from analyzeBehavioral import *
+
+"""
+Seconds between checks of a results file for newly written lines.
+"""
+REFRESH_INTERVAL = 5.0
+
+"""
+Line written by the rig once the experiment has ended.
+"""
+TERMINATION = 'Successful termination'
+
+
+class LiveMonitor:
+    """
+    Follows a results file while the experiment is still running. Each poll() reads only the bytes written since the
+    previous one, feeds complete lines to an incremental SessionParser and folds newly closed poke events and rotation
+    intervals into running aggregates. The poke event or wheel run in progress is counted once it closes.
+    """
+
+    def __init__(self, filename):
+        self.parser = SessionParser(filename)
+        self.finished = False
+        self.hourlyPokes = {}  # successful pokes per hour of the experiment
+        self.latencies = {}  # REWARD image -> RunningStats of hit latencies
+        self.distributions = {}  # REWARD image -> LatencyHistogram of hit latencies
+        self.rpms = {}  # image -> RunningStats of average rotation interval speeds
+        self._file = open(filename, 'rb')  # bytes, so a poll ending between '\r' and '\n' does not split a line
+        self._partial = b''  # trailing line that has not been completely written yet
+        self._pokesSeen = 0
+        self._runsSeen = 0
+
+    @property
+    def session(self):
+        return self.parser.session
+
+    def close(self):
+        self._file.close()
+
+    def poll(self):
+        """
+        Consume whatever has been appended to the file, returning True if any complete lines were read.
+        """
+        data = self._file.read()
+        if not data or self.finished:
+            return False
+        data = self._partial + data
+        end = data.rfind(b'\n') + 1  # lines are complete only once their '\n' is written
+        self._partial = data[end:]
+        if not end:
+            return False
+        lines = list(io.StringIO(data[:end].decode(), newline=None))  # newlines translated as by parseFile
+        self.parser.feed(lines)
+        if any(TERMINATION in line for line in lines):
+            self.parser.finish()
+            self.finished = True
+        self._update()
+        return True
+
+    def _update(self):
+        poke_events = self.session.poke_events
+        for pe in poke_events[self._pokesSeen:]:
+            for t, s in zip(pe.pumpTimes.tolist(), pe.pumpCodes.tolist()):
+                if s == PumpStates.On.value:
+                    hr = int(t / 3600) + 1
+                    self.hourlyPokes[hr] = self.hourlyPokes.get(hr, 0) + 1
+            if pe.latency is not None and pe.image.imageType is ImageTypes.REWARD:
+                if pe.image not in self.latencies:
+                    self.latencies[pe.image] = RunningStats()
+                    self.distributions[pe.image] = LatencyHistogram(TIMEOUTS.get(self.session.preset, 10))
+                self.latencies[pe.image].add(pe.latency)
+                self.distributions[pe.image].add(pe.latency)
+        self._pokesSeen = len(poke_events)
+
+        rotation_intervals = self.session.rotation_intervals
+        for ri in rotation_intervals[self._runsSeen:]:
+            self.rpms.setdefault(ri.image, RunningStats()).add(ri.avgSpeed)
+        self._runsSeen = len(rotation_intervals)
+
+
+def printReport(monitor):
+    session = monitor.session
+    print("\n{0} >> {1} poke events, {2} rotation intervals{3}".format(
+        session.identifier, len(session.poke_events), len(session.rotation_intervals),
+        " (finished)" if monitor.finished else ""))
+    for hr in sorted(monitor.hourlyPokes):
+        print("Successful pokes in hour #{0} >> {1}".format(hr, monitor.hourlyPokes[hr]))
+    for im in sorted(monitor.latencies, key=getContrast):
+        latencies = monitor.latencies[im]
+        print("{0} >> {1} hits, latency {2:.3f} +/- {3:.3f} sec (SEM)".format(im.name, latencies.n, latencies.mean,
+                                                                             latencies.sem))
+    for im in sorted(monitor.rpms, key=getContrast):
+        rpms = monitor.rpms[im]
+        print("{0} >> {1} runs, speed {2:.1f} +/- {3:.1f} RPM (SEM)".format(im.name, rpms.n, rpms.mean, rpms.sem))
+
+
+def follow(filename, interval=REFRESH_INTERVAL, report=printReport):
+    """
+    Poll FILENAME every INTERVAL seconds, calling REPORT with the LiveMonitor whenever new lines arrive, until the
+    experiment terminates. Returns the finished Session.
+    """
+    monitor = LiveMonitor(filename)
+    try:
+        while True:
+            if monitor.poll():
+                report(monitor)
+            if monitor.finished:
+                return monitor.session
+            time.sleep(interval)
+    finally:
+        monitor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Follow a results file while the experiment is running.')
+    parser.add_argument('filename')
+    parser.add_argument('-i', '--interval', type=float, default=REFRESH_INTERVAL,
+                        help='seconds between refreshes (default: {0})'.format(REFRESH_INTERVAL))
+    args = parser.parse_args()
+    try:
+        follow(args.filename, args.interval)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,160 @@
+import csv
+from collections import OrderedDict
+
+
+class OutputBackend:
+    """
+    Destination for the output of analysisFuncs for one session. Every backend is handed the same named tables through
+    writeTable(); backends with a WORKBOOK also receive the lab notebook layout written sheet by sheet. BASEPATH is the
+    output path without an extension, and close() returns the paths of every file written.
+    """
+    extension = None
+
+    def __init__(self, basePath):
+        self.basePath = basePath
+        self.paths = []
+
+    @property
+    def workbook(self):
+        return None
+
+    def tablePath(self, name):
+        return '{0}_{1}{2}'.format(self.basePath, name, self.extension)
+
+    def writeTable(self, name, headings, rows):
+        raise NotImplementedError
+
+    def close(self):
+        return self.paths
+
+
+class ExcelBackend(OutputBackend):
+    """
+    Single .xlsx workbook in the layout written by analysisFuncs. The tables are already laid out on its sheets, so
+    writeTable() does nothing.
+    """
+    extension = '.xlsx'
+
+    def __init__(self, basePath):
+        super().__init__(basePath)
+        from openpyxl import Workbook
+        self._wb = Workbook(write_only=True)  # rows are streamed to disk as they are appended
+        self._wb.create_sheet('Sheet')
+
+    @property
+    def workbook(self):
+        return self._wb
+
+    def writeTable(self, name, headings, rows):
+        pass
+
+    def close(self):
+        path = self.basePath + self.extension
+        self._wb.save(path)
+        self.paths.append(path)
+        return self.paths
+
+
+class CsvBackend(OutputBackend):
+    """
+    One plain CSV file per table, named <basePath>_<table>.csv. Missing values are written as empty fields.
+    """
+    extension = '.csv'
+
+    def writeTable(self, name, headings, rows):
+        path = self.tablePath(name)
+        with open(path, 'w', newline='') as outFile:
+            writer = csv.writer(outFile)
+            writer.writerow(headings)
+            writer.writerows(rows)
+        self.paths.append(path)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError('pyarrow is required for parquet and arrow output; install it or choose xlsx or csv')
+    return pyarrow
+
+
+_STATS = ['latency_mean', 'latency_sem', 'latency_sd']
+
+"""
+Column types of the named tables of analyzeBehavioral, as pyarrow type aliases. Parquet and Arrow files of these tables
+are written with exactly these types, so the same table has one schema across every session and the files can be read
+together as a dataset; other tables have their types inferred from their rows.
+"""
+TABLE_TYPES = {
+    'latencies': [('reward_time', 'float64'), ('contrast', 'int64'), ('latency', 'float64')],
+    'images': ([('image', 'string'), ('contrast', 'int64'), ('appearances', 'int64'), ('hits', 'int64')]
+               + [(prefix + stat, 'float64') for prefix in ('hits_', 'all_') for stat in _STATS]
+               + [('first_appearances', 'int64'), ('first_hits', 'int64')]
+               + [(prefix + stat, 'float64') for prefix in ('first_hits_', 'first_all_') for stat in _STATS]),
+    'hourly_pokes': [('hour', 'int64'), ('successful_pokes', 'int64')],
+    'rpms': [('image', 'string'), ('contrast', 'int64'), ('start_time', 'float64'), ('rotations', 'int64'),
+             ('rpm', 'float64')],
+}
+
+
+def toArrowTable(headings, rows, name=None):
+    """
+    Transpose ROWS into a pyarrow Table with one column per heading. Columns of a table NAME listed in TABLE_TYPES get
+    its fixed types; otherwise pyarrow infers each column's type.
+    """
+    pa = _pyarrow()
+    columns = list(zip(*rows)) if rows else [()] * len(headings)
+    if name not in TABLE_TYPES:
+        return pa.table([pa.array(column) for column in columns], names=list(headings))
+    schema = pa.schema([(column, pa.type_for_alias(alias)) for column, alias in TABLE_TYPES[name]])
+    if list(headings) != schema.names:
+        raise ValueError('table {0} has columns {1}, expected {2}'.format(name, list(headings), schema.names))
+    return pa.table([pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
+
+class ParquetBackend(OutputBackend):
+    """
+    One Parquet file per table, named <basePath>_<table>.parquet. Requires pyarrow.
+    """
+    extension = '.parquet'
+
+    def __init__(self, basePath):
+        super().__init__(basePath)
+        _pyarrow()  # fail before any analysis is done
+
+    def writeTable(self, name, headings, rows):
+        import pyarrow.parquet as pq
+        path = self.tablePath(name)
+        pq.write_table(toArrowTable(headings, rows, name), path)
+        self.paths.append(path)
+
+
+class ArrowBackend(OutputBackend):
+    """
+    One Arrow IPC (Feather v2) file per table, named <basePath>_<table>.arrow. Requires pyarrow.
+    """
+    extension = '.arrow'
+
+    def __init__(self, basePath):
+        super().__init__(basePath)
+        _pyarrow()
+
+    def writeTable(self, name, headings, rows):
+        import pyarrow.feather as feather
+        path = self.tablePath(name)
+        feather.write_feather(toArrowTable(headings, rows, name), path, compression='uncompressed')
+        self.paths.append(path)
+
+
+"""
+Output backends by the format name used to select them.
+"""
+BACKENDS = OrderedDict([('xlsx', ExcelBackend), ('csv', CsvBackend), ('parquet', ParquetBackend),
+                        ('arrow', ArrowBackend)])
+
+
+def openBackends(formats, basePath):
+    unknown = [f for f in formats if f not in BACKENDS]
+    if unknown:
+        raise ValueError('unknown output format(s): {0}'.format(', '.join(unknown)))
+    return [BACKENDS[f](basePath) for f in OrderedDict.fromkeys(formats)]
@@ -0,0 +1,187 @@
+import cProfile
+import contextvars
+import functools
+import json
+import os
+import time
+import tracemalloc
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+
+"""
+Environment variable switching on stage instrumentation when no --profile flag is given, e.g. BEHAVIOR_PROFILE=time or
+BEHAVIOR_PROFILE=memory,cprofile. Timing is always recorded once instrumentation is on.
+"""
+PROFILE_ENV = 'BEHAVIOR_PROFILE'
+PROFILE_MODES = ('time', 'memory', 'cprofile')
+
+# StageProfiler of the file being analyzed in the current thread or task, if any; each thread starts with none, so
+# sessions analyzed in threads record into their own profilers
+_active = contextvars.ContextVar('activeProfiler', default=None)
+
+
+def profileModes(value):
+    """
+    Set of PROFILE_MODES named by the comma-separated VALUE of a flag or PROFILE_ENV. An empty VALUE turns
+    instrumentation off; any other value turns on at least timing.
+    """
+    modes = {mode.strip().lower() for mode in (value or '').split(',') if mode.strip()}
+    unknown = modes.difference(PROFILE_MODES, ('1', 'on'))
+    if unknown:
+        raise ValueError('Unknown profile modes: {0}'.format(', '.join(sorted(unknown))))
+    return frozenset(modes.intersection(PROFILE_MODES)) | {'time'} if modes else frozenset()
+
+
+def environmentModes():
+    """
+    Set of PROFILE_MODES named by PROFILE_ENV. An invalid value is warned about and leaves instrumentation off rather
+    than failing each file analyzed; scripts should check it with profileModes() before starting instead.
+    """
+    try:
+        return profileModes(os.environ.get(PROFILE_ENV))
+    except ValueError as e:
+        warnings.warn('Ignoring {0}: {1}'.format(PROFILE_ENV, e), RuntimeWarning, stacklevel=2)
+        return frozenset()
+
+
+class StageProfiler:
+    """
+    Wall time, call count and, with the 'memory' mode, the tracemalloc peak of each named stage of one file's
+    analysis. A profiler is active in its thread between __enter__ and __exit__, during which stage() and @profiled
+    functions record into it; nested stages each count their own time and peak. The 'cprofile' mode also captures a
+    cProfile of the whole file. tracemalloc is process-wide, so memory peaks of files analyzed in concurrent threads
+    include each other's allocations.
+    """
+
+    def __init__(self, filename, modes=('time',)):
+        self.filename = filename
+        self.modes = frozenset(modes)
+        self.stages = OrderedDict()  # name -> [calls, seconds, peak bytes]
+        self.seconds = None
+        self.peakBytes = None
+        self.cprofile = cProfile.Profile() if 'cprofile' in self.modes else None
+        self._open = []  # running peaks of the stages currently open, innermost last
+        self._tracing = False
+
+    @property
+    def memory(self):
+        return 'memory' in self.modes
+
+    def __enter__(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self._token = _active.set(self)
+        self._peak = 0
+        self._start = time.perf_counter()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.seconds = time.perf_counter() - self._start
+        if self.memory:
+            self._foldPeak()
+            self.peakBytes = self._peak
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        _active.reset(self._token)
+        return False
+
+    def _foldPeak(self):
+        # tracemalloc keeps a single peak, so it is folded into every open stage and reset whenever a stage opens or
+        # closes; each stage then reports the highest traced memory seen while it was open
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        self._peak = max(self._peak, peak)
+        self._open = [max(p, peak) for p in self._open]
+
+    @contextmanager
+    def stage(self, name):
+        if self.memory:
+            self._foldPeak()
+        record = self.stages.setdefault(name, [0, 0.0, None])
+        self._open.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if self.memory:
+                self._foldPeak()
+            peak = self._open.pop()
+            record[0] += 1
+            record[1] += seconds
+            if self.memory:
+                record[2] = max(record[2] or 0, peak)
+
+    def report(self):
+        """
+        JSON-ready record of the file, its total time and peak, and each stage in the order it was first entered.
+        Peaks are None unless the 'memory' mode is on.
+        """
+        return {'filename': self.filename,
+                'modes': sorted(self.modes),
+                'seconds': self.seconds,
+                'peakBytes': self.peakBytes,
+                'stages': OrderedDict((name, {'calls': calls, 'seconds': seconds, 'peakBytes': peak})
+                                      for name, (calls, seconds, peak) in self.stages.items())}
+
+    def write(self, basePath):
+        """
+        Write the report to <basePath>_profile.json and, in the 'cprofile' mode, the pstats data to
+        <basePath>_profile.prof. Returns the paths written.
+        """
+        paths = [basePath + '_profile.json']
+        with open(paths[0], 'w') as reportFile:
+            json.dump(self.report(), reportFile, indent=1)
+        if self.cprofile is not None:
+            paths.append(basePath + '_profile.prof')
+            self.cprofile.dump_stats(paths[1])
+        return paths
+
+
+@contextmanager
+def stage(name):
+    """
+    Record the enclosed block as stage NAME of the active StageProfiler; does nothing when none is active.
+    """
+    profiler = _active.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+def profiled(name):
+    """
+    Decorator recording every call of the function as stage NAME of the active StageProfiler.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _active.get()
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def writeBatchReport(summaries, path):
+    """
+    Write the profile reports of every summary in SUMMARIES that has one to PATH, slowest file first, so outliers
+    in a large run are at the top. Returns the number of reports written.
+    """
+    reports = [dict(s['profile'], pokeEvents=s['pokeEvents'], rotationIntervals=s['rotationIntervals'],
+                    error=s['error']) for s in summaries if s.get('profile')]
+    reports.sort(key=lambda r: r['seconds'], reverse=True)
+    with open(path, 'w') as reportFile:
+        json.dump({'files': reports}, reportFile, indent=1)
+    return len(reports)
@@ -0,0 +1,95 @@
+# locating results files and reading their headers; standard library only, so header-only tools start without NumPy
+import os
+from enum import Enum, auto
+from itertools import islice
+
+"""
+Directory wherein all experimental data is stored. Can be recursively organized.
+"""
+LOCALDIR = 'Data/'
+
+"""
+Directory for cached parsed sessions and the results index; pass None as a cacheDir to always re-parse.
+"""
+CACHEDIR = '.cache/'
+
+"""
+Most lines read from the top of a results file when only its header is wanted; headers listing image hashes run to
+about 50 lines.
+"""
+HEADER_LINES = 100
+
+
+class Presets(Enum):
+    NIGHT_1 = auto()
+    NIGHT_2 = auto()
+    NIGHT_3 = auto()
+    NIGHT_4 = auto()
+    CONTRAST = auto()
+    SPATIAL = auto()
+
+
+def scanResults(location):
+    """
+    Walk LOCATION once with os.scandir, yielding (path, stat) for every results file beneath it. Each directory is
+    listed a single time and the stat comes from the directory listing where the platform provides it.
+    """
+    pending = [location]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+        for entry in entries:
+            if entry.is_dir():
+                pending.append(entry.path)
+            elif 'Results' in entry.name and '.txt' in entry.name and entry.is_file():
+                yield entry.path, entry.stat()
+
+
+def getFileNames(location):
+    return sorted(path for path, _ in scanResults(location))
+
+
+def readHeader(filename, limit=HEADER_LINES):
+    """
+    'Key: value' fields of the header of FILENAME, read up to the start of the experiment and never past LIMIT lines,
+    so the body is not touched.
+    """
+    fields = {}
+    with open(filename, 'r') as resultFile:
+        for line in islice(resultFile, limit):
+            if "Start of experiment" in line:
+                break
+            key, sep, value = line.partition(': ')
+            if sep:
+                fields[key.strip()] = value.strip()
+    return fields
+
+
+def directoryMetadata(filename):
+    """
+    Cohort and night of a results file from the directories it is filed under, e.g.
+    'WT-2, Starting June 19 2019/Night #3/Results - ....txt'.
+    """
+    night = os.path.dirname(os.path.abspath(filename))
+    return os.path.basename(os.path.dirname(night)), os.path.basename(night)
+
+
+def presetFromLabel(label):
+    # Presets member for the 'Experiment preset' header label; unrecognized labels are returned stripped but otherwise
+    # unchanged, so they compare equal wherever the header was read
+    label = label.strip()
+    if 'contrast' in label.lower():
+        return Presets.CONTRAST
+    elif 'spatial' in label.lower():
+        return Presets.SPATIAL
+    elif '1' in label:
+        return Presets.NIGHT_1
+    elif '2' in label:
+        return Presets.NIGHT_2
+    elif '3' in label:
+        return Presets.NIGHT_3
+    elif '4' in label:
+        return Presets.NIGHT_4
+    return label
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+from resultsFiles import *
+
+"""
+Location of the persistent index of results files. Bump INDEX_VERSION whenever the fields of an entry change.
+"""
+INDEXPATH = os.path.join(CACHEDIR, 'index.json')
+INDEX_VERSION = 1
+
+"""
+Threads reading headers of new or modified files during a refresh.
+"""
+INDEX_WORKERS = 8
+
+
+def _imageSet(value):
+    return [name.strip() for name in value.strip('[]').split(',') if name.strip()]
+
+
+def indexEntry(path, stat):
+    """
+    Index entry for the results file at PATH: its size and mtime from STAT, the cohort and night it is filed under
+    and the header fields, read without touching the body.
+    """
+    header = readHeader(path)
+    cohort, night = directoryMetadata(path)
+    label = header.get('Experiment preset', '')
+    preset = presetFromLabel(label)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'cohort': cohort, 'night': night, 'date': header.get('Date'),
+            'preset': preset.name if isinstance(preset, Presets) else label or None, 'presetLabel': label or None,
+            'cage': header.get('USB drive ID'), 'protocolHash': header.get('Protocol hash'),
+            'controlImages': _imageSet(header.get('Control image set', '')),
+            'rewardImages': _imageSet(header.get('Reward image set', ''))}
+
+
+class ResultsIndex:
+    """
+    Persistent index of results files keyed by absolute path. refresh() walks a directory once and re-reads the
+    header only of files whose size or mtime changed, so selecting files by preset, cohort, cage or image set is a
+    query over the index rather than a parse of every file.
+    """
+
+    def __init__(self, path=INDEXPATH):
+        self.path = path
+        self.entries = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as indexFile:
+                stored = json.load(indexFile)
+            if stored.get('version') == INDEX_VERSION:
+                self.entries = stored['entries']
+
+    def refresh(self, location, workers=INDEX_WORKERS):
+        """
+        Bring the entries beneath LOCATION up to date, dropping files that no longer exist or whose header can no
+        longer be read. Returns the number of headers read.
+        """
+        root = os.path.join(os.path.abspath(location), '')
+        seen, stale = set(), []
+        for path, stat in scanResults(location):
+            key = os.path.abspath(path)
+            seen.add(key)
+            entry = self.entries.get(key)
+            if entry is None or (entry['size'], entry['mtime']) != (stat.st_size, stat.st_mtime_ns):
+                stale.append((path, stat))
+
+        def read(item):
+            try:
+                return indexEntry(*item)
+            except (OSError, UnicodeDecodeError) as e:
+                print("Failed to index {0}: {1}".format(item[0], e))
+
+        for key in [k for k in self.entries if k.startswith(root) and k not in seen]:
+            del self.entries[key]
+        if not stale:
+            return 0
+        from concurrent.futures import ThreadPoolExecutor  # only needed when headers must be read
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (path, _), entry in zip(stale, pool.map(read, stale)):
+                if entry is None:
+                    self.entries.pop(os.path.abspath(path), None)  # an outdated entry must not pass for a current one
+                else:
+                    self.entries[entry['path']] = entry
+        return len(stale)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w') as indexFile:
+            json.dump({'version': INDEX_VERSION, 'entries': self.entries}, indexFile)
+        os.replace(self.path + '.tmp', self.path)
+
+    def select(self, **criteria):
+        """
+        Entries matching every keyword in CRITERIA, sorted by path. A criterion is either a value the field must equal
+        (a Presets member matches by name) or a predicate called with the field's value, e.g.
+        select(preset=Presets.CONTRAST, cohort=lambda c: c.startswith('RD10')).
+        """
+        def matches(entry):
+            for field, wanted in criteria.items():
+                value = entry.get(field)
+                if callable(wanted) and not isinstance(wanted, Presets):
+                    if not wanted(value):
+                        return False
+                elif value != (wanted.name if isinstance(wanted, Presets) else wanted):
+                    return False
+            return True
+
+        return sorted((e for e in self.entries.values() if matches(e)), key=lambda e: e['path'])
+
+    def paths(self, **criteria):
+        return [entry['path'] for entry in self.select(**criteria)]
+
+
+def indexResults(location, path=INDEXPATH):
+    """
+    Load the index at PATH, refresh it for LOCATION and save it.
+    """
+    index = ResultsIndex(path)
+    index.refresh(location)
+    index.save()
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Index results files by their headers and list those matching.')
+    parser.add_argument('location', nargs='?', default=LOCALDIR, help='directory searched recursively for results')
+    parser.add_argument('--preset', help='preset name, e.g. CONTRAST or NIGHT_3, or the exact header label of an '
+                                         'unrecognized preset, e.g. Test')
+    parser.add_argument('--cohort', help='only cohorts whose directory name contains this text')
+    parser.add_argument('--night', help='only nights whose directory name contains this text')
+    parser.add_argument('--cage', help='USB drive ID, e.g. "CAGE 1A"')
+    parser.add_argument('--summary', action='store_true', help='print the date, preset and cage of each file too')
+    args = parser.parse_args()
+    criteria = {}
+    if args.preset:
+        if args.preset.upper() in Presets.__members__:
+            criteria['preset'] = args.preset.upper()
+        else:
+            criteria['presetLabel'] = args.preset  # labels of unrecognized presets are matched as written
+    if args.cohort:
+        criteria['cohort'] = lambda c: args.cohort in c
+    if args.night:
+        criteria['night'] = lambda n: args.night in n
+    if args.cage:
+        criteria['cage'] = args.cage
+    for entry in indexResults(args.location).select(**criteria):
+        if args.summary:
+            print('\t'.join(str(entry[field]) for field in ('path', 'date', 'preset', 'cage')))
+        else:
+            print(entry['path'])
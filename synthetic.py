@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import os
+import random
+
+"""
+Hours in one night of recording; generated sessions are sized in multiples of it.
+"""
+NIGHT_HOURS = 12
+
+"""
+Seconds between the wheel sensor going high and low again within one revolution, as logged by the rig.
+"""
+SENSOR_DWELL = 0.022
+
+
+def _hash(text):
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def rewardImageNames(numImages):
+    # a single reward image is the plain checkerboard of the nightly presets, several form a contrast series
+    if numImages == 1:
+        return ['Checkerboard.png']
+    return ['Checkerboard-contrast_{0}.png'.format(i + 1) for i in range(numImages)]
+
+
+def generateResults(hours=NIGHT_HOURS, boutsPerHour=40, revolutionsPerBout=30, pokesPerHour=60, numImages=1,
+                    minRevolutions=10, rewardDuration=10.0, meanLatency=4.0, preset='Day #4', cage='CAGE 1A', seed=0):
+    """
+    Lines of a synthetic results file covering HOURS of recording. The header carries the fields initialize() reads
+    and the body interleaves the rig's Image, Door, Pump and Wheel lines: wheel bouts of about REVOLUTIONSPERBOUT
+    revolutions at BOUTSPERHOUR (each revolution logged as High, a 'revolution k of n' line and Low), and spontaneous
+    pokes at POKESPERHOUR. A bout of at least MINREVOLUTIONS shows one of NUMIMAGES reward images for up to
+    REWARDDURATION seconds; a poke while it is shown runs the pump and restores the control image.
+    """
+    rng = random.Random(seed)
+    control = 'Solid.png'
+    rewards = rewardImageNames(numImages)
+    duration = hours * 3600.0
+    yield 'Date: 2019-06-20 18:57:02.361285\n'
+    yield 'Experiment preset: {0}\n\n'.format(preset)
+    yield 'USB drive ID: {0}\n\n'.format(cage)
+    yield 'Control image set: [{0}]\n\n'.format(control)
+    yield 'Reward image set: [{0}]\n\n'.format(', '.join(rewards))
+    yield 'Minimum wheel revolutions for reward: {0:.1f}\n\n'.format(minRevolutions)
+    yield 'Maximum wheel revolutions for reward: {0:.1f}\n\n'.format(revolutionsPerBout * 3)
+    yield 'Maximum duration of reward state (seconds): {0:.1f}\n\n'.format(rewardDuration)
+    yield 'Duration of pump "on" state (seconds): 3.0\n\n'
+    yield 'Total duration of the experiment (hours): {0:.1f}\n\n'.format(hours)
+    yield 'Protocol hash: {0}\n'.format(_hash('{0}{1}'.format(preset, seed)))
+    yield 'Image hashes: \n'
+    for name in [control] + rewards:
+        yield '{0} - {1}\n'.format(name, _hash(name))
+    yield '-------------------------------Start of experiment-----------------------------------------------\n\n'
+    yield 'Door starting at: 0.013\nImage starting at: 0.014\nWheel starting at: 0.023\n'
+
+    def image(name, t):
+        return 'Image - Name: {0}, Hash: {1}, Time: {2:.3f}\n'.format(name, _hash(name), t)
+
+    def state(device, value, t):
+        return '{0} - State: {1}, Time: {2:.3f}\n'.format(device, value, t)
+
+    t = 0.261
+    yield image(control, t)
+    episodeRate = (boutsPerHour + pokesPerHour) / 3600.0
+    while True:
+        t += rng.expovariate(episodeRate) if episodeRate else duration
+        if t >= duration:
+            break
+        if rng.random() < boutsPerHour / (boutsPerHour + pokesPerHour):
+            revolutions = max(1, int(rng.gauss(revolutionsPerBout, revolutionsPerBout / 3)))
+            for k in range(1, revolutions + 1):
+                t += rng.uniform(0.8, 2.0)
+                yield state('Wheel', 'High', t)
+                yield 'Wheel revolution {0} of {1}\n'.format(k, revolutions)
+                yield state('Wheel', 'Low', t + SENSOR_DWELL)
+            if revolutions < minRevolutions:
+                continue
+            t += 0.065
+            yield image(rng.choice(rewards), t)
+            latency = rng.expovariate(1 / meanLatency)
+            if latency > rewardDuration:
+                t += rewardDuration
+                yield image(control, t)
+                continue
+            t += latency
+            yield state('Door', 'Low', t)
+            yield state('Pump', 'On', t + 0.003)
+            yield state('Door', 'High', t + rng.uniform(0.1, 0.5))
+            t += 3.001
+            yield state('Pump', 'Off', t)
+            t += 0.052
+            yield image(control, t)
+        else:
+            for _ in range(rng.randint(1, 4)):
+                t += rng.uniform(0.05, 2.0)
+                yield state('Door', 'Low', t)
+                t += rng.uniform(0.05, 1.5)
+                yield state('Door', 'High', t)
+    yield 'Successful termination at: {0}\n'.format(duration + 1.25438952446)
+
+
+def writeResults(directory, seed=0, **kwargs):
+    """
+    Write generateResults(seed=SEED, **KWARGS) to DIRECTORY under a rig-style 'Results - <date> <hash>.txt' name,
+    returning its path.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'Results - 2019-06-20 {0}.txt'.format(_hash('{0}{1}'.format(seed, kwargs))))
+    with open(path, 'w') as resultFile:
+        resultFile.writelines(generateResults(seed=seed, **kwargs))
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write a synthetic results file.')
+    parser.add_argument('directory')
+    parser.add_argument('--nights', type=float, default=1, help='session length in {0}-hour nights'.format(NIGHT_HOURS))
+    parser.add_argument('--bouts', type=float, default=40, help='wheel bouts per hour')
+    parser.add_argument('--revolutions', type=int, default=30, help='mean revolutions per bout')
+    parser.add_argument('--pokes', type=float, default=60, help='spontaneous pokes per hour')
+    parser.add_argument('--images', type=int, default=1, help='number of reward images')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(writeResults(args.directory, seed=args.seed, hours=NIGHT_HOURS * args.nights, boutsPerHour=args.bouts,
+                       revolutionsPerBout=args.revolutions, pokesPerHour=args.pokes, numImages=args.images))